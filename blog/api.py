@@ -0,0 +1,143 @@
+"""
+Read-only JSON API for posts and their comments
+
+    GET /api/posts/                      ?search= ?fields= ?limit= ?after=/?before=
+    GET /api/posts/<id>/                 ?fields=
+    GET /api/posts/<id>/comments/        ?fields= ?limit= ?after=/?before=
+
+Rows are serialized straight from values(), no model instances and no templates, and ?fields=
+(comma separated) restricts the SELECT to the columns behind the requested fields.
+The vote and comment counts are the denormalized counters of the blog row, so they come with the same query.
+Lists are keyset paginated (blog.pagination.CursorPaginator), `next`/`previous` are the URLs of the
+neighbouring pages. Every endpoint runs one query (a comment list that comes back empty checks the post exists).
+"""
+from django.db.models import F
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+
+from .models import Blog, Comment
+from .pagination import CursorPaginator
+
+# API field: model lookup
+POST_FIELDS = {
+    'id': 'id',
+    'title': 'title',
+    'content': 'content',
+    'content_html': 'content_html',
+    'excerpt': 'excerpt',
+    'author': 'posted_by__username',
+    'posted_at': 'posted_at',
+    'updated_at': 'updated_at',
+    'upvotes': 'upvote_count',
+    'downvotes': 'downvote_count',
+    'comments': 'comment_count',
+}
+COMMENT_FIELDS = {
+    'id': 'id',
+    'reply_to': 'parent_id',
+    'content': 'content',
+    'author': 'posted_by__username',
+    'posted_at': 'posted_at',
+    'updated_at': 'updated_at',
+}
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 100
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def _error(status, detail):
+    return JsonResponse({'detail': detail}, status=status)
+
+
+def _requested_fields(request, available):
+    """
+    the fields listed in ?fields=, all of them by default
+    """
+    names = [name.strip() for name in request.GET.get('fields', '').split(',') if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise BadRequest(f"unknown field(s): {', '.join(unknown)}, available: {', '.join(available)}")
+    return names or list(available)
+
+
+def _limit(request):
+    try:
+        limit = int(request.GET.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise BadRequest("limit must be an integer")
+    if not 1 <= limit <= MAX_LIMIT:
+        raise BadRequest(f"limit must be between 1 and {MAX_LIMIT}")
+    return limit
+
+
+def _values(queryset, available, names, extra=()):
+    """
+    queryset.values() of the columns behind `names`, renamed to the API names, plus the `extra`
+    columns the pagination needs
+    """
+    plain = [name for name in names if available[name] == name]
+    plain += [name for name in extra if name not in plain]
+    renamed = {name: F(available[name]) for name in names if available[name] != name}
+    return queryset.values(*plain, **renamed)
+
+
+def _page_response(request, queryset, available, names, ordering, limit):
+    keys = [name.lstrip('-') for name in ordering]
+    paginator = CursorPaginator(_values(queryset, available, names, extra=keys), limit, ordering=ordering)
+    page = paginator.get_page(request.GET)
+    return {
+        'results': [{name: row[name] for name in names} for row in page],
+        'next': request.build_absolute_uri(f'{request.path}?{page.next_querystring}') if page.has_next() else None,
+        'previous': request.build_absolute_uri(f'{request.path}?{page.previous_querystring}') if page.has_previous() else None,
+    }
+
+
+@require_GET
+def post_list(request):
+    """
+    Queries: 1, the page of posts joined with their authors
+    """
+    try:
+        names, limit = _requested_fields(request, POST_FIELDS), _limit(request)
+    except BadRequest as error:
+        return _error(400, str(error))
+    search_query = request.GET.get('search')
+    if search_query:
+        queryset, ordering = Blog.objects.search(search_query), ('-search_rank', '-posted_at', '-id')
+    else:
+        queryset, ordering = Blog.objects.all(), ('-posted_at', '-id')
+    return JsonResponse(_page_response(request, queryset, POST_FIELDS, names, ordering, limit))
+
+
+@require_GET
+def post_detail(request, blog_id):
+    """
+    Queries: 1
+    """
+    try:
+        names = _requested_fields(request, POST_FIELDS)
+    except BadRequest as error:
+        return _error(400, str(error))
+    row = next(iter(_values(Blog.objects.filter(pk=blog_id), POST_FIELDS, names)[:1]), None)
+    if row is None:
+        return _error(404, "Not found.")
+    return JsonResponse(row)
+
+
+@require_GET
+def post_comments(request, blog_id):
+    """
+    Queries: 1 for the page of comments joined with their authors, +1 when it is empty to tell an unknown post
+    """
+    try:
+        names, limit = _requested_fields(request, COMMENT_FIELDS), _limit(request)
+    except BadRequest as error:
+        return _error(400, str(error))
+    queryset = Comment.objects.filter(for_blog=blog_id)
+    data = _page_response(request, queryset, COMMENT_FIELDS, names, ('posted_at', 'id'), limit)
+    if not data['results'] and not Blog.objects.filter(pk=blog_id).exists():
+        return _error(404, "Not found.")
+    return JsonResponse(data)
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class BlogConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'blog'
+
+    def ready(self):
+        # registers the signal handlers
+        from . import signals  # noqa: F401
+        from django.db.backends.signals import connection_created
+        from .metrics import install_query_recorder
+        # the request metrics record the queries of every connection, sync_to_async threads' included
+        connection_created.connect(install_query_recorder)
@@ -0,0 +1,9 @@
+from django.urls import path
+
+from . import async_views, urls
+
+# blog.urls with the async reader views, used for ASGI requests (see BLOG_ASYNC_URLCONF)
+urlpatterns = [
+    path("", async_views.ListBlogView.as_view(), name="home"),
+    path("blog/<int:blog_id>/", async_views.blog_detail, name="blog_detail"),
+] + [pattern for pattern in urls.urlpatterns if pattern.name not in ("home", "blog_detail")]
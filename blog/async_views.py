@@ -0,0 +1,117 @@
+"""
+Async versions of the reader pages (the feed and the blog detail page) served to ASGI requests
+
+blog.middleware.AsyncViewsMiddleware routes ASGI requests here (BLOG_ASYNC_URLCONF), WSGI requests keep
+blog.views. The pages are the same and so is the caching, but the queries go through the async ORM.
+It runs them in thread-sensitive sync_to_async calls, one after the other within a request: the gain is
+across requests, each ASGI request has a thread of its own for its queries while the event loop goes on
+serving the others, where WSGI caps the requests in flight at its worker threads. POSTs are handed to the
+sync views. See `manage.py bench_asgi` for the comparison with WSGI.
+"""
+from asgiref.sync import sync_to_async
+from django.http import Http404
+from django.shortcuts import render
+from django.template.loader import render_to_string
+from django.views import View
+
+from . import views
+from .cache import BlogFragmentCache, FEED_VERSION_KEY, anonymous_page_cache, version_key
+from .conditional import blog_detail_validators, conditional_page, feed_validators
+from .forms import CommentForm
+from .models import Blog, Comment
+from .pageviews import count_views
+from .pagination import CursorPaginator, estimated_count
+
+
+async def _load_user(request):
+    # the templates read request.user, left lazy it would query the session and the user from the event loop
+    request.user = await request.auser()
+
+
+class ListBlogView(View):
+    """
+    async ListBlogView, same template and context
+    Queries: 1 for the ETag/Last-Modified validators, 1 for the page of blogs joined with their authors,
+    1 for the catalog lookup for the estimated total on PostgreSQL,
+    plus the session and user lookups for a logged in user
+    """
+    template_name = 'blog/index.html'
+    paginate_by = 5
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # decorated here rather than with method_decorator(), which hides that dispatch() is async
+        view = super().as_view(**initkwargs)
+        return anonymous_page_cache(lambda request: [FEED_VERSION_KEY])(conditional_page(feed_validators)(view))
+
+    async def get(self, request, *args, **kwargs):
+        await _load_user(request)
+        queryset = Blog.objects.for_feed(request.user)
+        search_query = request.GET.get('search')
+        if search_query:
+            paginator = CursorPaginator(queryset.search(search_query), self.paginate_by, ordering=('-search_rank', '-posted_at', '-id'))
+            page = await paginator.aget_page(request.GET)
+        else:
+            paginator = CursorPaginator(queryset, self.paginate_by, count_is_estimate=True)
+            page = await paginator.aget_page(request.GET)
+            paginator.count = await sync_to_async(estimated_count)(queryset)
+        return render(request, self.template_name, {
+            'paginator': paginator,
+            'page_obj': page,
+            'is_paginated': page.has_other_pages(),
+            'object_list': page.object_list,
+            'posts': page.object_list,
+            'view': self,
+        })
+
+
+async def _related_posts(blog_id):
+    return [post async for post in views.related_posts(blog_id)]
+
+
+@count_views
+@anonymous_page_cache(lambda request, blog_id: [version_key(blog_id)])
+@conditional_page(blog_detail_validators)
+async def blog_detail(request, blog_id):
+    """
+    async blog_detail, POSTs (reactions and comments) are handled by the sync view
+    The cached fragments are read in one cache round trip. Queries on a miss: 1 for the validators,
+    then the blog with its author, the related posts and the page of comments with their authors,
+    plus the session and user lookups for a logged in user
+    """
+    if request.method == 'POST':
+        return await sync_to_async(views.blog_detail)(request, blog_id)
+    await _load_user(request)
+
+    fragments = await sync_to_async(BlogFragmentCache)(blog_id)
+    comments = Comment.objects.filter(for_blog=blog_id).select_related('posted_by')
+    comment_pagin = views.comment_threads(comments)
+    keys = {
+        'body': fragments.key('body'),
+        'votes': fragments.key('votes'),
+        'related': fragments.key('related'),
+        'comments': fragments.key('comments', *fragments.page_parts(comment_pagin, request.GET)),
+    }
+    cached = await fragments.aget_many(keys)
+
+    # any missing fragment needs the blog row, the comment page takes its total from thread_count
+    blog, rendered = None, {}
+    if 'body' not in cached or 'votes' not in cached or 'comments' not in cached:
+        try:
+            blog = await Blog.objects.select_related('posted_by').aget(pk=blog_id)
+        except Blog.DoesNotExist:
+            raise Http404("No Blog matches the given query.")
+    if 'body' not in cached:
+        cached['body'] = rendered[keys['body']] = render_to_string("blog/blog_body.html", {'blog': blog})
+    if 'votes' not in cached:
+        cached['votes'] = rendered[keys['votes']] = {'up': blog.upvote_count, 'down': blog.downvote_count, 'views': blog.view_count, 'readers': blog.unique_readers}
+    if 'related' not in cached:
+        cached['related'] = rendered[keys['related']] = await _related_posts(blog_id)
+    if 'comments' not in cached:
+        comment_pagin.count = blog.thread_count
+        cached['comments'] = rendered[keys['comments']] = fragments.page_entry(await comment_pagin.aget_page(request.GET))
+    await fragments.aset_many(rendered)
+
+    page_obj = fragments.page_from_entry(cached['comments'], comment_pagin, request.GET)
+    votes = cached['votes']
+    return render(request, "blog/blog.html", {'blog_id': blog_id, 'blog_body': cached['body'], 'form': CommentForm(), 'page_obj': page_obj, 'up_vote_reaction': votes['up'], 'down_vote_reaction': votes['down'], 'votes': votes, 'related': cached['related']})
@@ -0,0 +1,80 @@
+"""
+request.user without a database query on the hot path
+
+The session payload is kept in the cache by the session engine (SESSION_ENGINE cached_db: the database
+is only read on a cache miss, and only written when the session changed). The logged in user is resolved
+by blog.middleware.CachedAuthenticationMiddleware from a snapshot of its USER_FIELDS kept in the
+BLOG_USER_CACHE cache, request.user is a User with only those fields loaded (the others load on access).
+
+The snapshot holds the session auth hash of the user (derived from its password), a session logged in
+before a password change doesn't match it and goes through django.contrib.auth.get_user(), which logs
+it out. Saving or deleting a user (password changes, UpdateUserForm.save()) drops its snapshot,
+logout() flushes the session from the cache and the database.
+"""
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.crypto import constant_time_compare
+
+USER_FIELDS = ('id', 'username', 'is_staff', 'is_active')
+MODEL_BACKEND = 'django.contrib.auth.backends.ModelBackend'
+
+
+def get_cache():
+    return caches[getattr(settings, 'BLOG_USER_CACHE', 'default')]
+
+
+def user_key(user_id):
+    return f'blog:user:{user_id}'
+
+
+def get_snapshot(user_id):
+    """
+    the cached USER_FIELDS and session auth hash of user `user_id`, None when there is no such active user
+    """
+    cache = get_cache()
+    snapshot = cache.get(user_key(user_id))
+    if snapshot is None:
+        # from the primary, a lagging replica would cache a user as it was before its last change
+        user = User.objects.using(DEFAULT_DB_ALIAS).only(*USER_FIELDS, 'password').filter(pk=user_id, is_active=True).first()
+        if user is None:
+            return None
+        snapshot = {field: getattr(user, field) for field in USER_FIELDS}
+        snapshot['session_auth_hash'] = user.get_session_auth_hash()
+        cache.set(user_key(user_id), snapshot, getattr(settings, 'BLOG_USER_CACHE_TIMEOUT', 300))
+    return snapshot
+
+
+def get_user(request):
+    """
+    the user of the request session from its snapshot, as django.contrib.auth.get_user() otherwise
+    (another authentication backend, a session hash that doesn't match)
+    """
+    try:
+        user_id = User._meta.pk.to_python(request.session[auth.SESSION_KEY])
+        backend_path = request.session[auth.BACKEND_SESSION_KEY]
+    except KeyError:
+        return AnonymousUser()
+    if backend_path != MODEL_BACKEND or backend_path not in settings.AUTHENTICATION_BACKENDS:
+        return auth.get_user(request)
+    snapshot = get_snapshot(user_id)
+    if snapshot is None:
+        return auth.get_user(request)
+    session_hash = request.session.get(auth.HASH_SESSION_KEY)
+    if not session_hash or not constant_time_compare(session_hash, snapshot['session_auth_hash']):
+        # checks the SECRET_KEY_FALLBACKS hashes, or flushes the session
+        return auth.get_user(request)
+    user = User.from_db(DEFAULT_DB_ALIAS, USER_FIELDS, [snapshot[field] for field in USER_FIELDS])
+    user.backend = backend_path
+    return user
+
+
+def forget_user(user_id):
+    """
+    drops the snapshot of user `user_id`, and again once the current transaction commits
+    (a request may have cached the old row meanwhile)
+    """
+    get_cache().delete(user_key(user_id))
+    transaction.on_commit(lambda: get_cache().delete(user_key(user_id)))
@@ -0,0 +1,348 @@
+"""
+Versioned fragment cache for the blog detail page, and full-page cache for anonymous readers
+
+Every fragment key embeds the blog's version number. The post_save/post_delete handlers in
+blog.signals bump it when the blog, one of its comments or one of its reactions changes, so
+invalidation is a single cache.incr() with no key scanning: stale fragments are never read again
+and just expire. A global generation number (invalidate_all_blogs) does the same for every blog.
+anonymous_page_cache keys whole responses on the same version numbers (plus a feed version for the home page).
+
+Only uses get/get_many/set/add/incr so it works with the local-memory and file backends.
+"""
+import functools
+import hashlib
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+from .metrics import record_cache
+from .pagination import CursorPage, InvalidCursor
+
+GENERATION_KEY = 'blog:version:all'
+# version of the home feed, bumped when any blog changes
+FEED_VERSION_KEY = 'blog:version:feed'
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[getattr(settings, 'BLOG_FRAGMENT_CACHE', 'default')]
+
+
+def version_key(blog_id):
+    return f'blog:version:{blog_id}'
+
+
+def _new_version():
+    # time based so a version key that got evicted never comes back with an old number
+    return time.time_ns()
+
+
+def _bump(key):
+    cache = get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, _new_version(), timeout=None)
+
+
+def bump_blog_version(blog_id):
+    _bump(version_key(blog_id))
+
+
+def bump_feed_version():
+    _bump(FEED_VERSION_KEY)
+
+
+def invalidate_all_blogs():
+    _bump(GENERATION_KEY)
+
+
+def current_versions(*keys):
+    """
+    current value of each version key, missing keys are initialised
+    """
+    cache = get_cache()
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            version = _new_version()
+            if not cache.add(key, version, timeout=None):
+                version = cache.get(key, version)
+            versions[key] = version
+    return tuple(versions[key] for key in keys)
+
+
+def _record(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+    record_cache(outcome)
+
+
+def fragment_cache_stats():
+    """
+    hit and miss counters of this process since start (or the last reset)
+    """
+    with _stats_lock:
+        return {'hits': _stats['hits'], 'misses': _stats['misses']}
+
+
+def page_cache_stats():
+    """
+    full-page cache counters of this process: fresh hits, misses (regenerations) and stale copies served
+    """
+    with _stats_lock:
+        return {'hits': _stats['page_hits'], 'misses': _stats['page_misses'], 'stale': _stats['page_stale']}
+
+
+def reset_fragment_cache_stats():
+    """
+    resets the fragment and the full-page counters
+    """
+    with _stats_lock:
+        _stats.clear()
+
+
+class BlogFragmentCache:
+    """
+    fragments of one blog at its current version
+
+        fragments = BlogFragmentCache(blog_id)
+        html = fragments.get_or_set('body', render_body)
+    """
+    def __init__(self, blog_id):
+        self.cache = get_cache()
+        self.blog_id = blog_id
+        self.timeout = getattr(settings, 'BLOG_FRAGMENT_CACHE_TIMEOUT', 3600)
+        generation, version = current_versions(GENERATION_KEY, version_key(blog_id))
+        self.prefix = f'blog:fragment:{blog_id}:{generation}:{version}'
+
+    def key(self, name, *parts):
+        if not parts:
+            return f'{self.prefix}:{name}'
+        digest = hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+        return f'{self.prefix}:{name}:{digest}'
+
+    def get_or_set(self, name, render, *parts):
+        """
+        returns the cached fragment, or calls render() and caches its (picklable) result
+        """
+        key = self.key(name, *parts)
+        value = self.cache.get(key)
+        if value is not None:
+            _record('hits')
+            return value
+        _record('misses')
+        value = render()
+        self.cache.set(key, value, self.timeout)
+        return value
+
+    def get_or_set_page(self, name, paginator, params, count):
+        """
+        caches a CursorPage of `paginator` as plain data (rows and flags, never the queryset),
+        invalid cursors share the first page's entry. count() is only called on a miss
+        """
+        def render():
+            paginator.count = count()
+            return self.page_entry(paginator.get_page(params))
+
+        entry = self.get_or_set(name, render, *self.page_parts(paginator, params))
+        return self.page_from_entry(entry, paginator, params)
+
+    @staticmethod
+    def page_parts(paginator, params):
+        """
+        the key parts of the page requested by `params`, the first page's for an invalid cursor
+        """
+        after, before = params.get('after', ''), params.get('before', '')
+        try:
+            for cursor in (after, before):
+                if cursor:
+                    paginator.decode_cursor(cursor)
+        except InvalidCursor:
+            after, before = '', ''
+        return after, before
+
+    @staticmethod
+    def page_entry(page):
+        return (page.object_list, page.number, page.has_next(), page.has_previous(), page.paginator.count)
+
+    @staticmethod
+    def page_from_entry(entry, paginator, params):
+        object_list, number, has_next, has_previous, paginator.count = entry
+        return CursorPage(object_list, number, paginator, has_next, has_previous, params=params)
+
+    async def aget_many(self, keys):
+        """
+        async lookup of several fragments in one round trip, `keys` maps names to self.key(...)
+        returns the cached values by name, missing fragments are left out
+        """
+        found = await self.cache.aget_many(list(keys.values()))
+        values = {}
+        for name, key in keys.items():
+            if key in found:
+                _record('hits')
+                values[name] = found[key]
+            else:
+                _record('misses')
+        return values
+
+    async def aset_many(self, values):
+        """
+        async store of several fragments, `values` maps self.key(...) to the value
+        """
+        if values:
+            await self.cache.aset_many(values, self.timeout)
+
+
+# query parameters that change the output of the cached pages, the others share the cached copy
+PAGE_CACHE_PARAMS = ('page', 'search', 'after', 'before')
+
+
+def _page_cache_key(request):
+    params = '&'.join(f'{name}={request.GET.get(name, "")}' for name in PAGE_CACHE_PARAMS)
+    digest = hashlib.md5(f'{request.path}?{params}'.encode()).hexdigest()
+    return f'blog:page:{digest}'
+
+
+def _is_cacheable_request(request):
+    """
+    only anonymous GETs: without a session cookie the user can't be logged in (and request.user
+    is never evaluated, so no session or user query), without a messages cookie nothing is pending
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    return not any(name in request.COOKIES for name in (settings.SESSION_COOKIE_NAME, 'messages'))
+
+
+def _is_cacheable_response(request, response):
+    # a response that sets cookies (e.g. the CSRF cookie for a form) is specific to this visitor
+    return response.status_code == 200 and not response.cookies and not request.META.get('CSRF_COOKIE_NEEDED')
+
+
+def anonymous_page_cache(version_keys):
+    """
+    view decorator serving whole cached responses to anonymous GETs, keyed by the path and PAGE_CACHE_PARAMS
+
+    `version_keys(request, *args, **kwargs)` returns the version keys the page depends on (see
+    bump_blog_version/bump_feed_version), a bump makes the cached copy stale at once.
+    Stampede protection: an expired or stale page is regenerated by the one request that wins a
+    cache.add() lock, the others serve the stale copy meanwhile (or wait for the fresh one when
+    there is no copy at all). Works on sync and async views, the cache calls of an async view run in a thread
+    """
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @functools.wraps(view_func)
+            async def async_wrapper(request, *args, **kwargs):
+                if not _is_cacheable_request(request):
+                    return await view_func(request, *args, **kwargs)
+                response, plan = await sync_to_async(_page_cache_lookup)(request, version_keys(request, *args, **kwargs))
+                if response is not None:
+                    return response
+                try:
+                    response = await view_func(request, *args, **kwargs)
+                    if plan is not None:
+                        await sync_to_async(_page_cache_store)(request, plan, response)
+                    return response
+                finally:
+                    if plan is not None:
+                        await sync_to_async(_page_cache_release)(plan)
+            return async_wrapper
+
+        @functools.wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if not _is_cacheable_request(request):
+                return view_func(request, *args, **kwargs)
+            response, plan = _page_cache_lookup(request, version_keys(request, *args, **kwargs))
+            if response is not None:
+                return response
+            try:
+                response = view_func(request, *args, **kwargs)
+                if plan is not None:
+                    _page_cache_store(request, plan, response)
+                return response
+            finally:
+                if plan is not None:
+                    _page_cache_release(plan)
+        return wrapper
+    return decorator
+
+
+def _page_cache_lookup(request, version_keys):
+    """
+    returns (cached response, None) when the request can be answered from the cache, else
+    (None, plan) where plan is the key/version to store the rendered page under, or None when
+    another request holds the regeneration lock and the page is rendered without caching
+    """
+    cache = get_cache()
+    key = _page_cache_key(request)
+    version = current_versions(GENERATION_KEY, *version_keys)
+    entry = cache.get(key)
+    if entry is not None and entry['version'] == version and entry['expires'] > time.time():
+        _record('page_hits')
+        return _cached_response(request, entry, 'hit'), None
+
+    lock_key = f'{key}:lock'
+    if not cache.add(lock_key, 1, getattr(settings, 'BLOG_PAGE_CACHE_LOCK_TIMEOUT', 10)):
+        # someone else is regenerating this page
+        if entry is not None:
+            _record('page_stale')
+            return _cached_response(request, entry, 'stale'), None
+        deadline = time.time() + getattr(settings, 'BLOG_PAGE_CACHE_LOCK_WAIT', 2)
+        while time.time() < deadline:
+            time.sleep(0.05)
+            entry = cache.get(key)
+            if entry is not None and entry['version'] == version:
+                _record('page_hits')
+                return _cached_response(request, entry, 'hit'), None
+        # the lock holder is too slow, render without caching
+        return None, None
+
+    _record('page_misses')
+    return None, {'key': key, 'lock_key': lock_key, 'version': version}
+
+
+def _page_cache_store(request, plan, response):
+    if hasattr(response, 'render') and not response.is_rendered:
+        response.render()
+    if _is_cacheable_response(request, response):
+        timeout = getattr(settings, 'BLOG_PAGE_CACHE_TIMEOUT', 300)
+        entry = {
+            'version': plan['version'],
+            'expires': time.time() + timeout,
+            'content': response.content,
+            'status': response.status_code,
+            'headers': dict(response.items()),
+        }
+        # kept past its expiry so concurrent requests can be served the stale copy
+        get_cache().set(plan['key'], entry, timeout * 2)
+        response['X-Page-Cache'] = 'miss'
+
+
+def _page_cache_release(plan):
+    get_cache().delete(plan['lock_key'])
+
+
+def _cached_response(request, entry, outcome):
+    """
+    rebuilds the cached response, answering 304 when it matches the request's
+    If-None-Match/If-Modified-Since (the ETag stored with the page, see blog.conditional)
+    """
+    response = HttpResponse(entry['content'], status=entry['status'])
+    for header, value in entry['headers'].items():
+        response[header] = value
+    response['X-Page-Cache'] = outcome
+    return get_conditional_response(
+        request,
+        etag=response.get('ETag'),
+        last_modified=parse_http_date_safe(response.get('Last-Modified', '')),
+        response=response,
+    )
@@ -0,0 +1,115 @@
+"""
+Conditional GET (ETag / Last-Modified / 304) for the feed and blog pages
+
+The validators come from one lightweight query, so a browser or reverse proxy revalidating
+a page gets a 304 without the page being built. The ETag is the authoritative validator: it also
+covers the vote counters, which have no timestamp, while Last-Modified only follows
+Blog.updated_at and the latest comment.
+"""
+import functools
+import hashlib
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db.models import Max, OuterRef, Subquery
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+from .cache import FEED_VERSION_KEY, GENERATION_KEY, PAGE_CACHE_PARAMS, current_versions
+from .models import Blog, Comment, RelatedPost
+
+
+def _viewer_and_params(request):
+    # the pages differ per user (edit/delete buttons, CSRF token) and per page/search parameters
+    user = getattr(request, 'user', None)
+    return [user.pk if user is not None else None] + [request.GET.get(name, '') for name in PAGE_CACHE_PARAMS]
+
+
+def blog_detail_validators(request, blog_id):
+    """
+    Query: 1, the blog row with its counters, the newest comment timestamp and the last build of its related posts
+    """
+    last_comment = Comment.objects.filter(for_blog=OuterRef('pk')).order_by().values('for_blog').annotate(last=Max('updated_at')).values('last')
+    related_at = RelatedPost.objects.filter(blog=OuterRef('pk')).order_by().values('blog').annotate(last=Max('computed_at')).values('last')
+    rows = (
+        Blog.objects.filter(pk=blog_id)
+        .annotate(last_comment=Subquery(last_comment), related_at=Subquery(related_at))
+        .values_list('updated_at', 'last_comment', 'related_at', 'upvote_count', 'downvote_count', 'comment_count', 'view_count', 'unique_readers')
+    )
+    row = next(iter(rows), None)
+    if row is None:
+        # let the view answer with its 404
+        return None, None
+    last_modified = max(timestamp for timestamp in row[:3] if timestamp is not None)
+    return ['blog_detail', blog_id, *row, *_viewer_and_params(request)], last_modified
+
+
+def feed_validators(request):
+    """
+    Query: 1, the newest Blog.updated_at (indexed). Deleted blogs don't change it, the feed version
+    bumped by blog.signals on any blog change is part of the ETag for that
+    """
+    last_modified = Blog.objects.aggregate(last=Max('updated_at'))['last']
+    versions = current_versions(GENERATION_KEY, FEED_VERSION_KEY)
+    return ['feed', last_modified, *versions, *_viewer_and_params(request)], last_modified
+
+
+def patch_reader_cache_headers(request, response):
+    """
+    anonymous pages may be stored by shared caches, but Vary: Cookie keeps a logged in user from
+    being served one, a logged in user's page is private and always revalidated
+    """
+    patch_vary_headers(response, ('Cookie',))
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(response, public=True, max_age=getattr(settings, 'BLOG_PUBLIC_MAX_AGE', 0), must_revalidate=True)
+
+
+def conditional_page(validators):
+    """
+    view decorator adding ETag/Last-Modified and answering 304 Not Modified from `validators`,
+    validators(request, *args, **kwargs) returns (etag parts, last modified) and is run once per request,
+    in a thread for an async view
+    """
+    def decorator(view_func):
+        def get_validators(request, *args, **kwargs):
+            if not hasattr(request, '_blog_validators'):
+                request._blog_validators = validators(request, *args, **kwargs)
+            return request._blog_validators
+
+        def etag(request, *args, **kwargs):
+            parts = get_validators(request, *args, **kwargs)[0]
+            if parts is None:
+                return None
+            return hashlib.md5(repr(parts).encode()).hexdigest()
+
+        def last_modified(request, *args, **kwargs):
+            return get_validators(request, *args, **kwargs)[1]
+
+        conditional_view = condition(etag_func=etag, last_modified_func=last_modified)(view_func)
+
+        if iscoroutinefunction(view_func):
+            @functools.wraps(view_func)
+            async def async_wrapper(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return await view_func(request, *args, **kwargs)
+                # condition() calls etag()/last_modified() synchronously, the query runs in a thread beforehand
+                await sync_to_async(get_validators)(request, *args, **kwargs)
+                response = await conditional_view(request, *args, **kwargs)
+                if response.status_code in (200, 304):
+                    await sync_to_async(patch_reader_cache_headers)(request, response)
+                return response
+            return async_wrapper
+
+        @functools.wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view_func(request, *args, **kwargs)
+            response = conditional_view(request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                patch_reader_cache_headers(request, response)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,144 @@
+"""
+Streaming export of blogs, comments and reactions as NDJSON or CSV, used by the staff export view
+and `manage.py export_blog`
+
+Rows are read in keyset batches ordered by (updated_at, id) (indexed on every model), each batch through
+values_list().iterator() so no model is instantiated and memory stays flat whatever the table size.
+The (updated_at, id) of the last row written is the position to continue from: an interrupted export
+resumes there and the next incremental export only gets the rows changed since.
+ASGI responses consume a sync iterator whole before sending its first byte, the export view streams
+them aexport_batches() through aencode() instead: one batch at a time, each fetched in a thread.
+The columns are the ones `manage.py import_blog` reads.
+"""
+import csv
+import datetime
+import json
+
+from asgiref.sync import sync_to_async
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Q
+from enumfields import Enum
+
+from .models import Blog, Comment, Reaction
+
+# export name: (model, {column: values_list() lookup})
+EXPORTS = {
+    'blogs': (Blog, {
+        'id': 'id', 'posted_by': 'posted_by__username', 'title': 'title', 'content': 'content',
+        'posted_at': 'posted_at', 'updated_at': 'updated_at',
+    }),
+    'comments': (Comment, {
+        'id': 'id', 'for_blog': 'for_blog_id', 'parent': 'parent_id', 'posted_by': 'posted_by__username', 'content': 'content',
+        'posted_at': 'posted_at', 'updated_at': 'updated_at',
+    }),
+    'reactions': (Reaction, {
+        'id': 'id', 'post': 'post_id', 'user': 'user__username', 'raection_type': 'raection_type',
+        'created_at': 'created_at', 'updated_at': 'updated_at',
+    }),
+}
+
+FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def columns(name):
+    return list(EXPORTS[name][1])
+
+
+def _export_query(name, using):
+    """
+    the (updated_at, id) ordered values_list() of export `name`, and the positions of updated_at and id in its rows
+    """
+    model, lookups = EXPORTS[name]
+    queryset = model.objects.using(using).order_by('updated_at', 'id').values_list(*lookups.values())
+    return queryset, list(lookups).index('updated_at'), list(lookups).index('id')
+
+
+def _position(since, after_id):
+    """
+    the rows after (since, after_id), or from `since` included when there is no after_id
+    """
+    if since is None:
+        return Q()
+    if after_id is None:
+        return Q(updated_at__gte=since)
+    return Q(updated_at__gt=since) | Q(updated_at=since, id__gt=after_id)
+
+
+def export_rows(name, since=None, after_id=None, batch_size=10000, chunk_size=2000, using=DEFAULT_DB_ALIAS):
+    """
+    yields the rows (tuples in columns() order) of export `name` ordered by (updated_at, id),
+    starting after (since, after_id), or at `since` included when there is no after_id
+    """
+    queryset, updated_at_index, id_index = _export_query(name, using)
+    while True:
+        # each batch is an index range scan and a short lived cursor
+        count = 0
+        for row in queryset.filter(_position(since, after_id))[:batch_size].iterator(chunk_size=chunk_size):
+            count += 1
+            last = row
+            yield row
+        if count < batch_size:
+            return
+        since, after_id = last[updated_at_index], last[id_index]
+
+
+async def aexport_batches(name, since=None, after_id=None, batch_size=2000, using=DEFAULT_DB_ALIAS):
+    """
+    export_rows() for ASGI responses, which consume a sync iterator whole before sending anything:
+    yields the rows a batch (list) at a time, each batch fetched in a thread, so one batch is held in memory
+    """
+    queryset, updated_at_index, id_index = _export_query(name, using)
+    while True:
+        batch = await sync_to_async(list)(queryset.filter(_position(since, after_id))[:batch_size])
+        if batch:
+            yield batch
+        if len(batch) < batch_size:
+            return
+        since, after_id = batch[-1][updated_at_index], batch[-1][id_index]
+
+
+def _plain(value):
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+class _Line:
+    """
+    file-like object handing back what csv.writer writes, one line at a time
+    """
+    def write(self, value):
+        return value
+
+
+def _line_encoder(name, export_format):
+    """
+    the function encoding one row as an NDJSON or CSV line
+    """
+    if export_format == 'csv':
+        writer = csv.writer(_Line())
+        return lambda row: writer.writerow([_plain(value) for value in row])
+    names = columns(name)
+    return lambda row: json.dumps(dict(zip(names, map(_plain, row))), ensure_ascii=False) + '\n'
+
+
+def encode(name, rows, export_format, header=True):
+    """
+    yields `rows` encoded as NDJSON lines or CSV lines (after a header line unless `header` is false)
+    """
+    if export_format == 'csv' and header:
+        yield csv.writer(_Line()).writerow(columns(name))
+    yield from map(_line_encoder(name, export_format), rows)
+
+
+async def aencode(name, batches, export_format, header=True):
+    """
+    encode() of the async `batches` of aexport_batches(), one chunk of lines per batch
+    """
+    if export_format == 'csv' and header:
+        yield csv.writer(_Line()).writerow(columns(name))
+    line = _line_encoder(name, export_format)
+    async for batch in batches:
+        yield ''.join(map(line, batch))
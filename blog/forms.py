@@ -6,16 +6,28 @@ from django.utils import timezone
 class BlogForm(forms.ModelForm):
     class Meta:
         model = Blog
-        fields = ('id', 'posted_by', 'title', 'content', 'posted_at', 'updated_at')
+        fields = ('id', 'posted_by', 'title', 'content', 'image', 'posted_at', 'updated_at')
         exclude = ('posted_at', 'updated_at', 'posted_by')
         read_only_fields = ('id',)
 
+    def _post_clean(self):
+        super()._post_clean()
+        # rendered once here, Blog.save() only renders content it wasn't rendered from
+        if 'content' in self.cleaned_data and not self.has_error('content'):
+            self.instance.render_content()
+
 class CommentForm(forms.ModelForm):
     class Meta:
         model = Comment
-        fields = ('id', 'posted_by', 'for_blog', 'content', 'posted_at', 'updated_at')
+        fields = ('id', 'posted_by', 'for_blog', 'parent', 'content', 'posted_at', 'updated_at')
         exclude = ('posted_by', 'for_blog', 'posted_at', 'updated_at')
         read_only_fields = ('id',)
+        widgets = {'parent': forms.HiddenInput}
+
+    def __init__(self, *args, blog_id=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # a reply is to a comment of the same blog, its path is all Comment.save() needs
+        self.fields['parent'].queryset = Comment.objects.filter(for_blog=blog_id).only('id', 'path', 'for_blog')
 
 class UserForm(forms.ModelForm):
     class Meta:
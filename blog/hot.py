@@ -0,0 +1,62 @@
+"""
+Hot ranking of the blogs, precomputed in HotScore for the /hot/ page
+
+    score = sign(points) * log10(max(|points|, 1)) + (posted_at - HOT_EPOCH) / BLOG_HOT_DECAY_SECONDS
+    points = upvotes - downvotes + BLOG_HOT_COMMENT_WEIGHT * comments
+
+A blog needs ten times the points of one posted BLOG_HOT_DECAY_SECONDS later to rank level with it, that
+is the time decay. It only depends on posted_at, so a score stays right until the counters of its blog
+change: refresh_hot_scores() only rescores the blogs whose activity_at (touched with every counter update)
+is past the start of the previous refresh, an indexed range scan instead of aggregates over the reactions
+and comments. The range starts BLOG_REFRESH_OVERLAP seconds earlier: a counter update that was timed before the
+previous refresh started but committed after it read the blogs is rescored by this one.
+"""
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Blog, HotScore
+
+HOT_EPOCH = 1577836800  # 2020-01-01 UTC
+
+
+def hot_score(upvotes, downvotes, comments, posted_at):
+    points = upvotes - downvotes + getattr(settings, 'BLOG_HOT_COMMENT_WEIGHT', 0.5) * comments
+    order = math.log10(max(abs(points), 1))
+    sign = (points > 0) - (points < 0)
+    return sign * order + (posted_at.timestamp() - HOT_EPOCH) / getattr(settings, 'BLOG_HOT_DECAY_SECONDS', 45000)
+
+
+def refresh_hot_scores(full=False, batch_size=1000, using=DEFAULT_DB_ALIAS):
+    """
+    rescores the blogs whose counters changed since the previous refresh (every blog when `full`
+    or on the first refresh) in batches ordered by id, returns the number of blogs rescored
+    """
+    started = timezone.now()
+    blogs = Blog.objects.using(using).order_by('pk')
+    if not full:
+        since = HotScore.objects.using(using).aggregate(last=Max('scored_at'))['last']
+        if since is not None:
+            blogs = blogs.filter(activity_at__gte=since - timedelta(seconds=getattr(settings, 'BLOG_REFRESH_OVERLAP', 300)))
+    rows = blogs.values_list('pk', 'posted_at', 'upvote_count', 'downvote_count', 'comment_count')
+    last_pk, rescored = 0, 0
+    while True:
+        batch = list(rows.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            return rescored
+        scores = [
+            HotScore(blog_id=pk, score=hot_score(upvotes, downvotes, comments, posted_at), scored_at=started)
+            for pk, posted_at, upvotes, downvotes, comments in batch
+        ]
+        with transaction.atomic(using=using):
+            HotScore.objects.using(using).bulk_create(
+                scores, update_conflicts=True, unique_fields=['blog'], update_fields=['score', 'scored_at'],
+            )
+        rescored += len(batch)
+        if len(batch) < batch_size:
+            return rescored
+        last_pk = batch[-1][0]
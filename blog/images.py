@@ -0,0 +1,135 @@
+"""
+Resized copies of the blog images, for the srcset of the blog page
+
+Once the blog holding a new image is committed, generate_variants() writes a WebP and a JPEG copy of it
+at each width of IMAGE_WIDTHS (no wider than the original) next to it in the storage, in a worker thread
+(BLOG_IMAGE_WORKERS of them) so the upload request doesn't wait. The file names carry a hash of the
+original, a replaced image gets new URLs: the copies never change and can be cached for a year.
+Until they exist the page shows the original. `manage.py generate_blog_images` generates the missing ones.
+"""
+import hashlib
+import io
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .cache import bump_blog_version
+from .models import Blog
+
+logger = logging.getLogger('blog.images')
+
+IMAGE_WIDTHS = (320, 640, 1280)
+# format: (extension, Pillow save options)
+IMAGE_FORMATS = {
+    'webp': ('webp', {'format': 'WEBP', 'quality': 80, 'method': 6}),
+    'jpeg': ('jpg', {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'BLOG_IMAGE_WORKERS', 2), thread_name_prefix='blog-images')
+    return _executor
+
+
+def schedule_variants(blog_id, replaced=None):
+    """
+    has the copies of the image of blog `blog_id` generated once the current transaction commits,
+    in a worker thread or right away with BLOG_IMAGE_WORKERS = 0, and the `replaced` ones deleted
+    """
+    def run():
+        if getattr(settings, 'BLOG_IMAGE_WORKERS', 2):
+            _get_executor().submit(_run_in_thread, blog_id, replaced)
+        else:
+            generate_variants(blog_id, replaced)
+
+    transaction.on_commit(run)
+
+
+def _run_in_thread(blog_id, replaced):
+    try:
+        generate_variants(blog_id, replaced)
+    except Exception:
+        logger.exception("generating the image copies of blog %s failed", blog_id)
+    finally:
+        # the thread's own connection
+        connection.close()
+
+
+def variant_widths(width):
+    """
+    the IMAGE_WIDTHS not wider than the original, the original width when it is narrower than all of them
+    """
+    return [size for size in IMAGE_WIDTHS if size <= width] or [width]
+
+
+def generate_variants(blog_id, replaced=None):
+    """
+    writes the copies of the image of blog `blog_id`, records them in Blog.image_variants and deletes
+    the files of `replaced` (image_variants of the previous image), returns the new image_variants
+    """
+    blog = Blog.objects.only('pk', 'image', 'image_width', 'image_height').filter(pk=blog_id).first()
+    variants = {}
+    if blog is not None and blog.image:
+        storage = blog.image.storage
+        with blog.image.open('rb') as source:
+            original = source.read()
+        digest = hashlib.sha256(original).hexdigest()[:12]
+        stem = posixpath.splitext(blog.image.name)[0]
+        with Image.open(io.BytesIO(original)) as image:
+            # phone pictures are stored sideways with an EXIF rotation
+            image = ImageOps.exif_transpose(image).convert('RGB')
+            for width in variant_widths(image.width):
+                resized = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+                for name, (extension, options) in IMAGE_FORMATS.items():
+                    output = io.BytesIO()
+                    resized.save(output, **options)
+                    saved = storage.save(f'{stem}.{digest}.{width}w.{extension}', ContentFile(output.getvalue()))
+                    variants.setdefault(name, []).append([width, saved])
+        # the image may have been replaced meanwhile, the copies are only recorded for this one
+        updated = Blog.objects.filter(pk=blog_id, image=blog.image.name).update(image_variants=variants, updated_at=timezone.now())
+        if not updated:
+            _delete(storage, variants)
+            return None
+        # the blog page is cached with the original image
+        bump_blog_version(blog_id)
+    if replaced:
+        _delete(Blog._meta.get_field('image').storage, replaced)
+    return variants
+
+
+def delete_files(blog):
+    """
+    deletes the image of a deleted blog and its copies once the deletion commits
+    """
+    storage, name, variants = blog.image.storage, blog.image.name, blog.image_variants
+
+    def delete():
+        if name:
+            storage.delete(name)
+        _delete(storage, variants)
+
+    transaction.on_commit(delete)
+
+
+def _delete(storage, variants):
+    for sizes in variants.values():
+        for _, name in sizes:
+            storage.delete(name)
+
+
+def srcset(blog, image_format):
+    """
+    the srcset attribute value of the copies of the blog image in `image_format`
+    """
+    storage = blog.image.storage
+    return ', '.join(f'{storage.url(name)} {width}w' for width, name in blog.image_variants.get(image_format, []))
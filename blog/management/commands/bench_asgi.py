@@ -0,0 +1,151 @@
+import asyncio
+import io
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+
+from blog.models import Blog
+
+NO_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the throughput of the feed and blog pages served by the WSGI application (sync views, "
+        "a fixed pool of worker threads) and the ASGI application (async views) with many concurrent clients. "
+        "The ASGI gain comes from concurrency across requests (each one runs its queries in a thread of its own, "
+        "one after the other), not within a request. "
+        "Requests go straight to the applications in this process, there is no HTTP server in between"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help="requests per application and path (default: 500)")
+        parser.add_argument('--concurrency', type=int, default=100, help="concurrent clients (default: 100)")
+        parser.add_argument('--wsgi-threads', type=int, default=8, help="worker threads of the WSGI server (default: 8)")
+        parser.add_argument('--db-latency', type=float, default=0, help="milliseconds added to every query to emulate a database over the network (default: 0)")
+        parser.add_argument('--path', action='append', dest='paths', help="path to request, repeatable (default: the feed and the newest blog)")
+        parser.add_argument('--cache', action='store_true', help="keep the page and fragment caches on, by default every request builds its page")
+        parser.add_argument('--seed', type=int, default=0, help="first create blogs until there are this many")
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            self.seed(options['seed'])
+        paths = options['paths']
+        if not paths:
+            latest = Blog.objects.order_by('-posted_at', '-id').values_list('pk', flat=True).first()
+            if latest is None:
+                raise CommandError("there is no blog to request, run with --seed")
+            paths = ['/', f'/blog/{latest}/']
+        if options['db_latency']:
+            self.add_latency(options['db_latency'] / 1000)
+
+        # imported late, the modules build their application at import time
+        from i_blog.asgi import application as asgi_application
+        from i_blog.wsgi import application as wsgi_application
+
+        with override_settings(**({} if options['cache'] else {'CACHES': NO_CACHE})):
+            for path in paths:
+                self.stdout.write(f"GET {path}: {options['requests']} requests, {options['concurrency']} clients")
+                wsgi = self.run_wsgi(wsgi_application, path, options['requests'], options['wsgi_threads'])
+                self.report(f"wsgi ({options['wsgi_threads']} threads)", wsgi)
+                asgi = asyncio.run(self.run_asgi(asgi_application, path, options['requests'], options['concurrency']))
+                self.report("asgi", asgi)
+                self.stdout.write(self.style.SUCCESS(f"  asgi/wsgi throughput: {wsgi['elapsed'] / asgi['elapsed']:.2f}x"))
+
+    def seed(self, count):
+        author, _ = User.objects.get_or_create(username='bench', defaults={'is_staff': True})
+        missing = count - Blog.objects.count()
+        Blog.objects.bulk_create(
+            Blog(title=f"Benchmark post {i}", content="Benchmark content. " * 50, posted_by=author)
+            for i in range(max(missing, 0))
+        )
+
+    def add_latency(self, seconds):
+        def wait(execute, sql, params, many, context):
+            time.sleep(seconds)
+            return execute(sql, params, many, context)
+
+        def install(sender, connection, **kwargs):
+            if wait not in connection.execute_wrappers:
+                connection.execute_wrappers.append(wait)
+
+        # every thread opens its own connection
+        self._latency_receiver = install
+        connection_created.connect(install)
+        if connection.connection is not None:
+            install(None, connection)
+
+    def run_wsgi(self, application, path, requests, threads):
+        url = urlsplit(path)
+
+        def get(_):
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': url.path, 'QUERY_STRING': url.query, 'SCRIPT_NAME': '',
+                'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_HOST': 'localhost',
+                'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+                'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+            }
+            status = []
+            start = time.perf_counter()
+            response = application(environ, lambda line, headers, exc_info=None: status.append(int(line.split()[0])))
+            try:
+                b''.join(response)
+            finally:
+                response.close()
+            return status[0], time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            results = list(pool.map(get, range(requests)))
+        return {'elapsed': time.perf_counter() - start, 'results': results}
+
+    async def run_asgi(self, application, path, requests, concurrency):
+        url = urlsplit(path)
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': url.path, 'raw_path': url.path.encode(), 'query_string': url.query.encode(), 'root_path': '',
+            'headers': [(b'host', b'localhost')], 'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+        }
+        clients = asyncio.Semaphore(concurrency)
+
+        async def get():
+            body_sent = False
+            status = []
+
+            async def receive():
+                nonlocal body_sent
+                if not body_sent:
+                    body_sent = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                # the client never disconnects
+                await asyncio.Future()
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+
+            async with clients:
+                start = time.perf_counter()
+                await application(dict(scope), receive, send)
+                return status[0], time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(get() for _ in range(requests)))
+        return {'elapsed': time.perf_counter() - start, 'results': results}
+
+    def report(self, label, run):
+        latencies = sorted(latency for _, latency in run['results'])
+        errors = sum(1 for status, _ in run['results'] if status != 200)
+        p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+        self.stdout.write(
+            f"  {label:<18} {len(latencies) / run['elapsed']:8.1f} req/s   "
+            f"p50 {statistics.median(latencies) * 1000:7.1f} ms   p95 {p95 * 1000:7.1f} ms   non-200: {errors}"
+        )
@@ -0,0 +1,209 @@
+import json
+import math
+import statistics
+import time
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from blog.cache import invalidate_all_blogs
+from blog.models import Blog, Comment, Reaction
+
+NO_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+BENCH_USER = 'bench_user_{}'
+
+
+def percentile(values, percent):
+    """
+    nearest-rank percentile of a non-empty list
+    """
+    ordered = sorted(values)
+    return ordered[max(math.ceil(len(ordered) * percent / 100) - 1, 0)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures every GET endpoint of blog/urls.py on a benchmark dataset of the configured database: users "
+        "named bench_user_N and their posts, comments and reactions, which --seed creates (only the missing ones). "
+        "It is never written without --seed, point the command at a scratch database to run it there. Requests go "
+        "through the test client, anonymous and logged in. Reports p50/p95/p99 latency, queries "
+        "and bytes per request as JSON and fails when a baseline report shows a regression"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', action='store_true', help="create the missing bench users, posts, comments and reactions in the database first")
+        parser.add_argument('--users', type=int, default=50, help="users (default: 50)")
+        parser.add_argument('--posts', type=int, default=200, help="posts (default: 200)")
+        parser.add_argument('--comments', type=int, default=20, help="comments per post (default: 20)")
+        parser.add_argument('--reactions', type=int, default=10, help="reactions per post, at most one per user (default: 10)")
+        parser.add_argument('--requests', type=int, default=50, help="measured requests per endpoint (default: 50)")
+        parser.add_argument('--warmup', type=int, default=5, help="requests per endpoint before measuring (default: 5)")
+        parser.add_argument('--no-cache', action='store_true', help="turn the page and fragment caches off, every request builds its page")
+        parser.add_argument('--host', default='localhost', help="Host header of the requests, must be in ALLOWED_HOSTS (default: localhost)")
+        parser.add_argument('--output', help="write the report to this file instead of stdout")
+        parser.add_argument('--baseline', help="compare against this report, a regression fails the command")
+        parser.add_argument('--save-baseline', action='store_true', help="write the report to --baseline instead of comparing")
+        parser.add_argument('--tolerance', type=float, default=0.25, help="allowed p95 latency growth over the baseline (default: 0.25, i.e. 25%%)")
+        parser.add_argument('--slack', type=float, default=2.0, help="p95 latency growth in ms that is always allowed, absorbs timer noise (default: 2)")
+
+    def handle(self, *args, **options):
+        if options['reactions'] > options['users']:
+            raise CommandError("--reactions can't exceed --users, a user votes once per post")
+        if options['save_baseline'] and not options['baseline']:
+            raise CommandError("--save-baseline needs --baseline")
+
+        if options['seed']:
+            self.seed(options['users'], options['posts'], options['comments'], options['reactions'])
+        author, posts = self.dataset(options['users'], options['posts'])
+        with override_settings(**({'CACHES': NO_CACHE} if options['no_cache'] else {})):
+            endpoints = self.measure(author, posts, options)
+        report = {
+            'dataset': {key: options[key] for key in ('users', 'posts', 'comments', 'reactions')},
+            'requests': options['requests'],
+            'cache': not options['no_cache'],
+            'endpoints': endpoints,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            Path(options['output']).write_text(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        if not options['baseline']:
+            return
+        baseline_path = Path(options['baseline'])
+        if options['save_baseline']:
+            baseline_path.write_text(output + '\n')
+            self.stderr.write(f"baseline saved to {baseline_path}")
+            return
+        regressions = self.compare(json.loads(baseline_path.read_text()), report, options['tolerance'], options['slack'])
+        for regression in regressions:
+            self.stderr.write(self.style.ERROR(regression))
+        if regressions:
+            raise CommandError(f"{len(regressions)} regression(s) against {baseline_path}")
+        self.stderr.write(self.style.SUCCESS(f"no regression against {baseline_path}"))
+
+    def seed(self, users, posts, comments, reactions):
+        """
+        creates the missing bench users, posts, comments and reactions
+        """
+        names = [BENCH_USER.format(i) for i in range(users)]
+        existing = set(User.objects.filter(username__in=names).values_list('username', flat=True))
+        User.objects.bulk_create(User(username=name) for name in names if name not in existing)
+        bench_users = list(User.objects.filter(username__in=names).order_by('id'))
+        author = bench_users[0]
+
+        bench_posts = Blog.objects.filter(posted_by=author)
+        missing = posts - bench_posts.count()
+        if missing > 0:
+            new_posts = [Blog(posted_by=author, title=f"Bench post {i}", content="Benchmark post content. " * 40) for i in range(missing)]
+            for post in new_posts:
+                # bulk_create skips save(), which renders the content
+                post.render_content()
+            Blog.objects.bulk_create(new_posts)
+        bench_posts = list(bench_posts.order_by('-posted_at', '-id')[:posts])
+
+        comment_counts = dict(Comment.objects.filter(for_blog__in=bench_posts).values_list('for_blog').annotate(total=Count('pk')))
+        Comment.objects.bulk_create(
+            Comment(posted_by=bench_users[(post.pk + i) % users], for_blog=post, content=f"Bench comment {i}")
+            for post in bench_posts
+            for i in range(comment_counts.get(post.pk, 0), comments)
+        )
+        Comment.objects.fill_paths()
+        voted = set(Reaction.objects.filter(post__in=bench_posts).values_list('post', 'user'))
+        Reaction.objects.bulk_create(
+            Reaction(post=post, user=user, raection_type='upvote' if i % 4 else 'downvote')
+            for post in bench_posts
+            for i, user in enumerate(bench_users[:reactions])
+            if (post.pk, user.pk) not in voted
+        )
+        # bulk_create sends no signals
+        Blog.objects.filter(pk__in=[post.pk for post in bench_posts]).recount_counters()
+        invalidate_all_blogs()
+
+    def dataset(self, users, posts):
+        """
+        the author and the posts of the bench dataset, CommandError when it isn't in the database
+        """
+        author = User.objects.filter(username=BENCH_USER.format(0)).first()
+        bench_posts = list(Blog.objects.filter(posted_by=author).order_by('-posted_at', '-id')[:posts]) if author else []
+        if User.objects.filter(username__in=[BENCH_USER.format(i) for i in range(users)]).count() < users or len(bench_posts) < posts:
+            raise CommandError(f"the bench dataset isn't in the {connection.alias} database, pass --seed to create it there")
+        return author, bench_posts
+
+    def endpoints(self, posts):
+        post = posts[0]
+        return [
+            ('home', reverse('home')),
+            ('home_search', f"{reverse('home')}?search=benchmark"),
+            ('hot', reverse('hot')),
+            ('blog_detail', reverse('blog_detail', args=[post.pk])),
+            ('edit_blog', reverse('edit_blog', args=[post.pk])),
+            ('new_blog_post', reverse('new_blog_post')),
+            ('account', reverse('account')),
+            ('login', reverse('login')),
+            ('signup', reverse('signup')),
+            ('forgot_password', reverse('forgot_password')),
+            ('api_posts', reverse('api_posts')),
+            ('api_post', reverse('api_post', args=[post.pk])),
+            ('api_post_comments', reverse('api_post_comments', args=[post.pk])),
+        ]
+
+    def measure(self, author, posts, options):
+        results = {}
+        for user in ('anonymous', 'logged_in'):
+            client = Client(HTTP_HOST=options['host'])
+            if user == 'logged_in':
+                client.force_login(author)
+            for name, url in self.endpoints(posts):
+                for _ in range(options['warmup']):
+                    client.get(url)
+                latencies, queries, sizes, statuses = [], [], [], set()
+                for _ in range(options['requests']):
+                    with CaptureQueriesContext(connection) as context:
+                        start = time.perf_counter()
+                        response = client.get(url)
+                        content = b''.join(response.streaming_content) if response.streaming else response.content
+                        latencies.append((time.perf_counter() - start) * 1000)
+                    queries.append(len(context.captured_queries))
+                    sizes.append(len(content))
+                    statuses.add(response.status_code)
+                results[f'{name} {user}'] = {
+                    'url': url,
+                    'status': sorted(statuses),
+                    'p50_ms': round(percentile(latencies, 50), 3),
+                    'p95_ms': round(percentile(latencies, 95), 3),
+                    'p99_ms': round(percentile(latencies, 99), 3),
+                    'queries': max(queries),
+                    'queries_mean': round(statistics.mean(queries), 2),
+                    'bytes': max(sizes),
+                }
+        return results
+
+    def compare(self, baseline, report, tolerance, slack):
+        """
+        the regressions of `report`: a slower p95, more queries or another status than the baseline
+        """
+        regressions = []
+        if baseline.get('dataset') != report['dataset'] or baseline.get('cache') != report['cache']:
+            regressions.append("the baseline was measured on another dataset or cache setting, rerun with --save-baseline")
+            return regressions
+        for name, result in report['endpoints'].items():
+            before = baseline['endpoints'].get(name)
+            if before is None:
+                continue
+            allowed = before['p95_ms'] * (1 + tolerance) + slack
+            if result['p95_ms'] > allowed:
+                regressions.append(f"{name}: p95 {result['p95_ms']} ms, baseline {before['p95_ms']} ms (allowed {allowed:.3f} ms)")
+            if result['queries'] > before['queries']:
+                regressions.append(f"{name}: {result['queries']} queries per request, baseline {before['queries']}")
+            if result['status'] != before['status']:
+                regressions.append(f"{name}: status {result['status']}, baseline {before['status']}")
+        return regressions
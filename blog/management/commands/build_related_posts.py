@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from blog.related import build_related_posts
+
+
+class Command(BaseCommand):
+    help = (
+        "Builds the related posts of the blog pages (blog.related) from the TF-IDF similarity of their text: "
+        "rescores the blogs edited since the previous build and the lists they enter or leave, run it "
+        "periodically (e.g. every 10 minutes from cron). --full rescores every blog, run it from time to time "
+        "(e.g. nightly) and after changing BLOG_RELATED_COUNT or BLOG_RELATED_MIN_SCORE"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="rescore every blog")
+        parser.add_argument('--top-k', type=int, default=None, help="related posts per blog (default: BLOG_RELATED_COUNT)")
+        parser.add_argument('--block-size', type=int, default=256, help="blogs scored against all the others at once, memory grows with it (default: 256)")
+        parser.add_argument('--batch-size', type=int, default=1000, help="blogs per query and rows per insert (default: 1000)")
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help="database alias (default: default)")
+
+    def handle(self, *args, **options):
+        rescored = build_related_posts(
+            full=options['full'], top_k=options['top_k'], block_size=options['block_size'],
+            batch_size=options['batch_size'], using=options['database'],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Rescored the related posts of {rescored} blog(s)"))
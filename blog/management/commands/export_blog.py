@@ -0,0 +1,88 @@
+import json
+import os
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from blog.export import EXPORTS, FORMATS, columns, encode, export_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Streams every blog, comment or reaction as NDJSON or CSV ordered by (updated_at, id) with flat memory. "
+        "With --state the position of the last row written is saved as the export goes: a rerun resumes "
+        "an interrupted export, or exports only what changed since the last one (incremental mode)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=sorted(EXPORTS), help="what to export")
+        parser.add_argument('--format', choices=sorted(FORMATS), default='ndjson', help="output format (default: ndjson)")
+        parser.add_argument('--output', help="file to write, appended to when it exists (default: stdout)")
+        parser.add_argument('--since', help="only the rows updated at or after this ISO datetime")
+        parser.add_argument('--after-id', type=int, help="with --since, start after the row (since, after-id)")
+        parser.add_argument('--state', help="JSON file holding the position of the last row written, read and updated")
+        parser.add_argument('--batch-size', type=int, default=10000, help="rows per query (default: 10000)")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="rows fetched at a time within a query (default: 2000)")
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help="database alias (default: default)")
+
+    def handle(self, *args, **options):
+        name = options['model']
+        since, after_id = self.parse_since(options['since']), options['after_id']
+        state_path = Path(options['state']) if options['state'] else None
+        if state_path is not None and state_path.exists():
+            state = json.loads(state_path.read_text())
+            if state['model'] != name:
+                raise CommandError(f"{state_path} is the state of the {state['model']} export")
+            since, after_id = self.parse_since(state['updated_at']), state['id']
+
+        rows = export_rows(name, since=since, after_id=after_id, batch_size=options['batch_size'], chunk_size=options['chunk_size'], using=options['database'])
+        names = columns(name)
+        updated_at_index, id_index = names.index('updated_at'), names.index('id')
+        last = None
+
+        def tracked():
+            nonlocal last
+            for row in rows:
+                last = row
+                yield row
+
+        if options['output']:
+            output = open(options['output'], 'a', newline='', encoding='utf-8')
+            header = output.tell() == 0
+            write = output.write
+        else:
+            output, header = self.stdout, True
+            write = lambda line: self.stdout.write(line, ending='')
+        written = 0
+        try:
+            for line in encode(name, tracked(), options['format'], header=header):
+                write(line)
+                written += 1
+                if state_path is not None and last is not None and written % options['batch_size'] == 0:
+                    output.flush()
+                    self.save_state(state_path, name, last[updated_at_index], last[id_index])
+            output.flush()
+            if state_path is not None and last is not None:
+                self.save_state(state_path, name, last[updated_at_index], last[id_index])
+        finally:
+            if output is not self.stdout:
+                output.close()
+        count = written - (1 if header and options['format'] == 'csv' else 0)
+        self.stderr.write(self.style.SUCCESS(f"Exported {count} {name}"))
+
+    def parse_since(self, value):
+        if not value:
+            return None
+        since = parse_datetime(value)
+        if since is None:
+            raise CommandError(f"not an ISO datetime: {value}")
+        return timezone.make_aware(since) if timezone.is_naive(since) else since
+
+    def save_state(self, path, name, updated_at, row_id):
+        # written next to the file and renamed, a crash never leaves half a state
+        temporary = path.with_name(f'{path.name}.tmp')
+        temporary.write_text(json.dumps({'model': name, 'updated_at': updated_at.isoformat(), 'id': row_id}))
+        os.replace(temporary, path)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from blog.pageviews import flush_views
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes the blog page views and readers buffered in the cache (blog.pageviews) to Blog.view_count "
+        "and Blog.unique_readers, run it periodically (e.g. every minute from cron)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="blogs per cache lookup and bulk update (default: 1000)")
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help="database alias (default: default)")
+
+    def handle(self, *args, **options):
+        flushed = flush_views(batch_size=options['batch_size'], using=options['database'])
+        self.stdout.write(self.style.SUCCESS(f"Flushed the views of {flushed} blog(s)"))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from blog.images import generate_variants
+from blog.models import Blog
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates the resized WebP/JPEG copies of the blog images that have none (the upload worker failed "
+        "or the image was loaded in bulk), --all generates them again for every image, after a change to "
+        "blog.images"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="every blog image, not only the ones without copies")
+
+    def handle(self, *args, **options):
+        blogs = Blog.objects.exclude(image='').order_by('pk')
+        if not options['all']:
+            blogs = blogs.filter(image_variants={})
+        generated = 0
+        for blog in blogs.only('pk', 'image_variants').iterator():
+            # the copies generated before are replaced
+            replaced = blog.image_variants if options['all'] else None
+            if generate_variants(blog.pk, replaced) is not None:
+                generated += 1
+        self.stdout.write(self.style.SUCCESS(f"Generated the copies of {generated} image(s)"))
@@ -0,0 +1,261 @@
+import csv
+import io
+import itertools
+import json
+import time
+
+from django.contrib.auth.models import User
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, models, transaction
+from django.utils import timezone
+
+from blog.cache import bump_feed_version, invalidate_all_blogs
+from blog.models import Blog, Comment, ImportCheckpoint, Reaction
+
+MODELS = {'blogs': Blog, 'comments': Comment, 'reactions': Reaction}
+
+# input columns holding a reference, resolved through the in-memory maps: users by username, blogs by id
+REFERENCES = {
+    'blogs': {'posted_by': 'user'},
+    'comments': {'posted_by': 'user', 'for_blog': 'blog'},
+    'reactions': {'user': 'user', 'post': 'blog'},
+}
+
+
+def read_records(path, input_format):
+    """
+    streams the records of a JSONL (one object per line) or CSV (with a header) file as dicts
+    """
+    with open(path, newline='', encoding='utf-8') as source:
+        if input_format == 'csv':
+            yield from csv.DictReader(source)
+        else:
+            for line in source:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def copy_value(value):
+    """
+    one value in PostgreSQL's COPY text format
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk loads blogs, comments or reactions from a JSONL or CSV file. Columns are the model fields, "
+        "posted_by/user are usernames and for_blog/post are blog ids (give blogs their archive id so "
+        "comments and reactions can refer to them), parent is the id of the comment replied to (imported before it). "
+        "Rows are written with bulk_create, or COPY on PostgreSQL, reactions are upserted on (post, user) instead: "
+        "the last vote of a user on a blog wins, over the file and the table. Each chunk is written "
+        "in one transaction, which also records the progress in an ImportCheckpoint row so a failed "
+        "import can be resumed exactly after the last chunk committed, and recounts the counters of the blogs "
+        "the chunk refers to. The caches are invalidated at the end"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="JSONL or CSV file")
+        parser.add_argument('--model', required=True, choices=sorted(MODELS), help="what the file holds")
+        parser.add_argument('--format', choices=['jsonl', 'csv'], help="input format (default: from the file extension)")
+        parser.add_argument('--batch-size', type=int, default=1000, help="rows per INSERT (default: 1000)")
+        parser.add_argument('--chunk-size', type=int, default=20000, help="records per transaction and checkpoint (default: 20000)")
+        parser.add_argument('--create-users', action='store_true', help="create the users that don't exist (unusable password) instead of skipping their rows")
+        parser.add_argument('--no-copy', action='store_true', help="use bulk_create on PostgreSQL too")
+        parser.add_argument('--checkpoint', help="checkpoint name (default: PATH)")
+        parser.add_argument('--resume', action='store_true', help="continue after the records of the checkpoint")
+        parser.add_argument('--restart', action='store_true', help="drop the checkpoint and import from the first record")
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help="database alias (default: default)")
+
+    def handle(self, *args, **options):
+        self.model = MODELS[options['model']]
+        self.references = REFERENCES[options['model']]
+        self.using = options['database']
+        self.connection = connections[self.using]
+        self.batch_size = options['batch_size']
+        self.create_users = options['create_users']
+        self.use_copy = self.connection.vendor == 'postgresql' and not options['no_copy']
+        input_format = options['format'] or ('csv' if options['path'].lower().endswith('.csv') else 'jsonl')
+        checkpoint_name = options['checkpoint'] or options['path']
+
+        checkpoints = ImportCheckpoint.objects.using(self.using)
+        if options['restart']:
+            checkpoints.filter(name=checkpoint_name).delete()
+        checkpoint = checkpoints.filter(name=checkpoint_name).first()
+        done = {'records': 0, 'rows': 0}
+        if checkpoint is not None:
+            if not options['resume']:
+                raise CommandError(
+                    f"an earlier import of {checkpoint_name} stopped after {checkpoint.records} records: pass --resume, or --restart"
+                )
+            if checkpoint.model != options['model']:
+                raise CommandError(f"{checkpoint_name} is the checkpoint of an import of {checkpoint.model}")
+            done = {'records': checkpoint.records, 'rows': checkpoint.rows}
+            self.stdout.write(f"resuming after {done['records']} records")
+
+        # the lookup maps, loaded once
+        self.users = dict(User.objects.using(self.using).values_list('username', 'pk'))
+        self.blogs = set(Blog.objects.using(self.using).values_list('pk', flat=True)) if 'blog' in self.references.values() else set()
+        self.skipped = 0
+        self.explicit_pk = False
+
+        records = itertools.islice(read_records(options['path'], input_format), done['records'], None)
+        start = time.perf_counter()
+        imported = 0
+        while True:
+            chunk = list(itertools.islice(records, options['chunk_size']))
+            if not chunk:
+                break
+            with transaction.atomic(using=self.using):
+                rows = self.import_chunk(chunk)
+                done = {'records': done['records'] + len(chunk), 'rows': done['rows'] + rows}
+                # committed with the chunk, or rolled back with it
+                checkpoints.update_or_create(name=checkpoint_name, defaults={'model': options['model'], **done})
+            imported += rows
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"{done['records']} records, {done['rows']} rows, {imported / elapsed:.0f} rows/s")
+
+        self.finish()
+        elapsed = time.perf_counter() - start
+        checkpoints.filter(name=checkpoint_name).delete()
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {imported} {options['model']} in {elapsed:.1f}s ({imported / elapsed if elapsed else 0:.0f} rows/s), skipped {self.skipped}"
+        ))
+
+    def import_chunk(self, chunk):
+        """
+        inserts the records of one chunk and recounts the counters of the blogs they refer to, in its
+        transaction so a resumed import doesn't leave the blogs of the committed chunks stale. Returns the number of rows written
+        """
+        self.touched_blogs = set()
+        if self.create_users:
+            self.add_missing_users(chunk)
+        objs = [obj for obj in map(self.build, chunk) if obj is not None]
+        if self.model is Reaction:
+            objs = self.last_votes(objs)
+        if self.model is Blog:
+            # bulk writes skip save(), which renders the content
+            for obj in objs:
+                obj.render_content()
+        for with_pk in (True, False):
+            batch = [obj for obj in objs if (obj.pk is not None) == with_pk]
+            if not batch:
+                continue
+            if self.model is Reaction:
+                # unique_reaction_per_user, a vote already in the table is replaced like set_reaction() does
+                self.model.objects.using(self.using).bulk_create(
+                    batch, batch_size=self.batch_size,
+                    update_conflicts=True, unique_fields=['post', 'user'], update_fields=['raection_type', 'updated_at'],
+                )
+            elif self.use_copy:
+                self.copy(batch, with_pk)
+            else:
+                self.model.objects.using(self.using).bulk_create(batch, batch_size=self.batch_size)
+            self.explicit_pk |= with_pk
+        if self.model is Blog:
+            self.blogs.update(obj.pk for obj in objs if obj.pk is not None)
+        blog_ids = sorted(self.touched_blogs)
+        for start in range(0, len(blog_ids), self.batch_size):
+            Blog.objects.using(self.using).filter(pk__in=blog_ids[start:start + self.batch_size]).recount_counters()
+        return len(objs)
+
+    def last_votes(self, reactions):
+        """
+        the last reaction of each (post, user) of the chunk, the ones it replaces are counted as skipped
+        (one INSERT ... ON CONFLICT can't update the same row twice)
+        """
+        votes = {}
+        for reaction in reactions:
+            key = (reaction.post_id, reaction.user_id)
+            if key in votes:
+                self.skip({'post': reaction.post_id, 'user': reaction.user_id}, 'replaced by a later vote')
+            votes[key] = reaction
+        return list(votes.values())
+
+    def add_missing_users(self, chunk):
+        names = {record[column] for record in chunk for column, kind in self.references.items() if kind == 'user' and record.get(column)}
+        missing = names - self.users.keys()
+        if missing:
+            User.objects.using(self.using).bulk_create(
+                (User(username=name, password='!') for name in missing), batch_size=self.batch_size, ignore_conflicts=True,
+            )
+            self.users.update(User.objects.using(self.using).filter(username__in=missing).values_list('username', 'pk'))
+
+    def build(self, record):
+        """
+        the model instance of one record, None (and counted as skipped) when it refers to a missing
+        user or blog or holds an invalid value
+        """
+        opts = self.model._meta
+        values = {}
+        try:
+            for column, value in record.items():
+                if value is None or value == '':
+                    # left to the field default
+                    continue
+                kind = self.references.get(column)
+                if kind == 'user':
+                    values[opts.get_field(column).attname] = self.users[value]
+                elif kind == 'blog':
+                    blog_id = int(value)
+                    if blog_id not in self.blogs:
+                        raise KeyError(blog_id)
+                    values[opts.get_field(column).attname] = blog_id
+                    self.touched_blogs.add(blog_id)
+                else:
+                    field = opts.pk if column == 'pk' else opts.get_field(column)
+                    value = field.to_python(value)
+                    if isinstance(field, models.DateTimeField) and timezone.is_naive(value):
+                        value = timezone.make_aware(value)
+                    values[field.attname] = value
+            return self.model(**values)
+        except FieldDoesNotExist as error:
+            raise CommandError(f"unknown column for {opts.label}: {error}")
+        except (KeyError, ValueError, ValidationError) as error:
+            self.skip(record, error)
+            return None
+
+    def skip(self, record, error):
+        self.skipped += 1
+        if self.skipped <= 10:
+            self.stderr.write(f"skipped {record!r}: {error!r}")
+
+    def copy(self, objs, with_pk):
+        """
+        writes `objs` with COPY ... FROM STDIN, the values go through the fields like in an INSERT
+        """
+        fields = [field for field in self.model._meta.concrete_fields if with_pk or not field.primary_key]
+        buffer = io.StringIO()
+        for obj in objs:
+            values = (field.get_db_prep_save(field.pre_save(obj, True), connection=self.connection) for field in fields)
+            buffer.write('\t'.join(map(copy_value, values)) + '\n')
+        buffer.seek(0)
+        columns = ', '.join(self.connection.ops.quote_name(field.column) for field in fields)
+        sql = f"COPY {self.connection.ops.quote_name(self.model._meta.db_table)} ({columns}) FROM STDIN"
+        with self.connection.cursor() as cursor:
+            if hasattr(cursor, 'copy_expert'):
+                # psycopg2
+                cursor.copy_expert(sql, buffer)
+            else:
+                with cursor.copy(sql) as copy:
+                    copy.write(buffer.getvalue())
+
+    def finish(self):
+        """
+        what the bulk writes skipped: the sequence after explicit ids, the comment paths and the caches
+        """
+        if self.explicit_pk:
+            with self.connection.cursor() as cursor:
+                for sql in self.connection.ops.sequence_reset_sql(no_style(), [self.model]):
+                    cursor.execute(sql)
+        if self.model is Comment:
+            # bulk writes skip save(), which sets the path
+            Comment.objects.using(self.using).fill_paths(self.batch_size)
+        invalidate_all_blogs()
+        bump_feed_version()
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from blog.models import Blog
+from blog.cache import invalidate_all_blogs
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the denormalized upvote/downvote/comment counters on Blog from the Reaction and Comment tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument('blog_ids', nargs='*', type=int, help="only recount these blogs (default: all)")
+
+    def handle(self, *args, **options):
+        blogs = Blog.objects.all()
+        if options['blog_ids']:
+            blogs = blogs.filter(pk__in=options['blog_ids'])
+        updated = blogs.recount_counters()
+        # the vote counts are cached with the blog fragments
+        invalidate_all_blogs()
+        self.stdout.write(self.style.SUCCESS(f"Recounted counters for {updated} blog(s)"))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from blog.hot import refresh_hot_scores
+
+
+class Command(BaseCommand):
+    help = (
+        "Refreshes the hot ranking of /hot/ (blog.hot): rescores the blogs whose votes or comments changed "
+        "since the previous run, run it periodically (e.g. every minute from cron). --full rescores every "
+        "blog, after changing BLOG_HOT_DECAY_SECONDS or BLOG_HOT_COMMENT_WEIGHT"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="rescore every blog")
+        parser.add_argument('--batch-size', type=int, default=1000, help="blogs per query and upsert (default: 1000)")
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help="database alias (default: default)")
+
+    def handle(self, *args, **options):
+        rescored = refresh_hot_scores(full=options['full'], batch_size=options['batch_size'], using=options['database'])
+        self.stdout.write(self.style.SUCCESS(f"Rescored {rescored} blog(s)"))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from blog.cache import bump_feed_version, invalidate_all_blogs
+from blog.models import Blog
+
+
+class Command(BaseCommand):
+    help = (
+        "Renders Blog.content to content_html and excerpt for the blogs that have none (written in bulk, "
+        "or before the field existed), in batches ordered by id. --all renders every blog again, after "
+        "a change to blog.markup"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="render every blog, not only the ones without content_html")
+        parser.add_argument('--batch-size', type=int, default=500, help="blogs per query and UPDATE (default: 500)")
+
+    def handle(self, *args, **options):
+        blogs = Blog.objects.order_by('pk').only('pk', 'content')
+        if not options['all']:
+            blogs = blogs.filter(content_html='')
+        last_pk, rendered = 0, 0
+        while True:
+            batch = list(blogs.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not batch:
+                break
+            for blog in batch:
+                blog.render_content()
+            with transaction.atomic():
+                Blog.objects.bulk_update(batch, ['content_html', 'excerpt'])
+            last_pk = batch[-1].pk
+            rendered += len(batch)
+            self.stdout.write(f"{rendered} blogs rendered")
+        # the blog pages and the feed are cached with the old rendering
+        invalidate_all_blogs()
+        bump_feed_version()
+        self.stdout.write(self.style.SUCCESS(f"Rendered {rendered} blog(s)"))
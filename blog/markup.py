@@ -0,0 +1,148 @@
+"""
+Markdown rendering of post content, done once when a post is saved (Blog.render_content)
+
+The source is HTML-escaped before any markup is applied, so HTML written in a post shows as text and
+the output only holds the tags generated here: it is sanitized by construction, and safe to mark safe
+in the templates. The Markdown subset:
+
+    # heading (to ######)       paragraphs, a single newline is a <br>
+    **strong**  *emphasis*      `code`, and ``` fenced code blocks
+    - or * list items           1. numbered list items
+    > quotes                    [text](https://link), http(s), mailto and site relative links only
+"""
+import html
+import re
+
+from django.utils.html import strip_tags
+from django.utils.text import Truncator
+
+EXCERPT_LENGTH = 200
+
+HEADING = re.compile(r'^(#{1,6})\s+(.*?)\s*#*\s*$')
+BULLET_ITEM = re.compile(r'^[-*+]\s+(.*)$')
+NUMBERED_ITEM = re.compile(r'^\d+[.)]\s+(.*)$')
+QUOTE = re.compile(r'^>\s?(.*)$')
+FENCE = re.compile(r'^\s*```')
+# tags ending a line of text, a space in the excerpt
+LINE_END = re.compile(r'<br>|</(?:p|li|h\d|blockquote|pre)>')
+
+CODE_SPAN = re.compile(r'`([^`]+)`')
+LINK = re.compile(r'\[([^\]]+)\]\(([^)\s]+)\)')
+STRONG = re.compile(r'\*\*(?=\S)(.+?)(?<=\S)\*\*|__(?=\S)(.+?)(?<=\S)__')
+EMPHASIS = re.compile(r'\*(?=\S)(.+?)(?<=\S)\*|(?<!\w)_(?=\S)(.+?)(?<=\S)_(?!\w)')
+# local paths, but not //host nor /\host (browsers read both as protocol-relative, off-site)
+SAFE_URL = re.compile(r'^(?:https?://|mailto:|/(?![/\\])|#)', re.IGNORECASE)
+
+
+def _emphasis(text):
+    text = STRONG.sub(lambda match: f'<strong>{match.group(1) or match.group(2)}</strong>', text)
+    return EMPHASIS.sub(lambda match: f'<em>{match.group(1) or match.group(2)}</em>', text)
+
+
+def _inline(text):
+    """
+    the inline markup of one (unescaped) line of text, escaped
+    """
+    text = html.escape(text, quote=True)
+    # code spans and links are kept aside so no emphasis is applied inside them or their URL
+    kept = []
+
+    def keep(fragment):
+        kept.append(fragment)
+        return f'\x00{len(kept) - 1}\x00'
+
+    text = CODE_SPAN.sub(lambda match: keep(f'<code>{match.group(1)}</code>'), text)
+
+    def link(match):
+        label, url = match.groups()
+        if not SAFE_URL.match(html.unescape(url)):
+            return match.group(0)
+        return keep(f'<a href="{url}" rel="nofollow noopener">{_emphasis(label)}</a>')
+
+    text = _emphasis(LINK.sub(link, text))
+    while '\x00' in text:
+        text = re.sub('\x00(\\d+)\x00', lambda match: kept[int(match.group(1))], text)
+    return text
+
+
+def _blocks(lines):
+    """
+    splits the lines into (kind, lines) blocks: 'code', 'heading', 'quote', 'ul', 'ol' and 'p'
+    """
+    block_kind, block = None, []
+    lines = iter(lines)
+    for line in lines:
+        if FENCE.match(line):
+            if block:
+                yield block_kind, block
+                block_kind, block = None, []
+            code = []
+            for line in lines:
+                if FENCE.match(line):
+                    break
+                code.append(line)
+            yield 'code', code
+            continue
+        if not line.strip():
+            if block:
+                yield block_kind, block
+                block_kind, block = None, []
+            continue
+        if HEADING.match(line):
+            if block:
+                yield block_kind, block
+                block_kind, block = None, []
+            yield 'heading', [line]
+            continue
+        kind = 'quote' if QUOTE.match(line) else 'ul' if BULLET_ITEM.match(line) else 'ol' if NUMBERED_ITEM.match(line) else 'p'
+        if block and kind != block_kind:
+            if kind == 'p' and block_kind in ('ul', 'ol'):
+                # a plain line right after a list item continues it
+                block.append(line)
+                continue
+            yield block_kind, block
+            block = []
+        block_kind = kind
+        block.append(line)
+    if block:
+        yield block_kind, block
+
+
+def render_markdown(source):
+    """
+    the HTML of a Markdown `source`
+    """
+    output = []
+    # NUL marks the fragments _inline() keeps aside
+    source = source.replace('\x00', '').replace('\r\n', '\n').replace('\r', '\n')
+    for kind, lines in _blocks(source.split('\n')):
+        if kind == 'code':
+            output.append(f"<pre><code>{html.escape(chr(10).join(lines), quote=True)}</code></pre>")
+        elif kind == 'heading':
+            marks, text = HEADING.match(lines[0]).groups()
+            output.append(f'<h{len(marks)}>{_inline(text)}</h{len(marks)}>')
+        elif kind == 'quote':
+            quoted = '\n'.join(QUOTE.match(line).group(1) if QUOTE.match(line) else line for line in lines)
+            output.append(f'<blockquote>{render_markdown(quoted)}</blockquote>')
+        elif kind in ('ul', 'ol'):
+            pattern = BULLET_ITEM if kind == 'ul' else NUMBERED_ITEM
+            items = []
+            for line in lines:
+                match = pattern.match(line)
+                if match:
+                    items.append([match.group(1)])
+                else:
+                    # a continuation line of the previous item
+                    items[-1].append(line.strip())
+            output.append(f'<{kind}>' + ''.join(f"<li>{'<br>'.join(map(_inline, item))}</li>" for item in items) + f'</{kind}>')
+        else:
+            output.append(f"<p>{'<br>'.join(_inline(line.strip()) for line in lines)}</p>")
+    return '\n'.join(output)
+
+
+def excerpt(content_html, length=EXCERPT_LENGTH):
+    """
+    the text of `content_html` on one line, shortened to `length` characters (ellipsis included)
+    """
+    text = ' '.join(html.unescape(strip_tags(LINE_END.sub(' ', content_html))).split())
+    return Truncator(text).chars(length)
@@ -0,0 +1,230 @@
+"""
+Per-request performance measurements, aggregated per URL name
+
+blog.middleware.RequestMetricsMiddleware measures every request: wall time, SQL queries and the time
+spent in them (record_queries(), installed on every connection), template rendering (TimedDjangoTemplates, the template
+backend of settings.TEMPLATES) and the hits and misses of the blog fragment and page caches (blog.cache).
+They go out as a Server-Timing header and into the histograms of this process, served in the Prometheus
+text format by the staff only /metrics/ view along with the throttle counters (blog.throttle).
+Each worker process keeps its own histograms, scrape them all.
+"""
+import functools
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.template.backends.django import DjangoTemplates, Template
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# metric: (help, buckets, RequestTimings attribute)
+HISTOGRAMS = {
+    'blog_request_duration_seconds': ("Wall time of the request", DURATION_BUCKETS, 'total'),
+    'blog_request_db_seconds': ("Time spent running SQL queries", DURATION_BUCKETS, 'db'),
+    'blog_request_queries': ("SQL queries run", QUERY_BUCKETS, 'queries'),
+    'blog_request_template_seconds': ("Time spent rendering templates", DURATION_BUCKETS, 'template'),
+}
+
+# blog.cache stats outcome: (cache, outcome) labels
+CACHE_OUTCOMES = {
+    'hits': ('fragment', 'hit'),
+    'misses': ('fragment', 'miss'),
+    'page_hits': ('page', 'hit'),
+    'page_misses': ('page', 'miss'),
+    'page_stale': ('page', 'stale'),
+}
+
+_current = ContextVar('blog_request_timings', default=None)
+# the execute wrappers of recording_queries() active in the current context
+_query_recorders = ContextVar('blog_query_recorders', default=())
+
+
+class RequestTimings:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.total = 0.0
+        self.db = 0.0
+        self.queries = 0
+        self.template = 0.0
+        self.cache = Counter()
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - start
+            self.queries += 1
+
+    def finish(self):
+        self.total = time.perf_counter() - self.start
+
+    def server_timing(self):
+        """
+        the Server-Timing header value, durations in milliseconds
+        """
+        metrics = [
+            f'db;dur={self.db * 1000:.1f};desc="{self.queries} queries"',
+            f'tpl;dur={self.template * 1000:.1f}',
+        ]
+        if self.cache:
+            outcomes = ' '.join(f'{cache}-{outcome}={count}' for (cache, outcome), count in sorted(self.cache.items()))
+            metrics.append(f'cache;desc="{outcomes}"')
+        metrics.append(f'total;dur={self.total * 1000:.1f}')
+        return ', '.join(metrics)
+
+
+def begin_request():
+    """
+    starts measuring a request, returns its RequestTimings and the token for end_request()
+    """
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """
+    connection_created receiver adding record_queries() to every connection, in whatever thread it is opened:
+    the async ORM runs its queries on the connections of the sync_to_async threads, not the event loop's
+    """
+    if record_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_queries)
+
+
+def record_queries(execute, sql, params, many, context):
+    """
+    the execute wrapper passing each query through the recorders of the current context
+    """
+    for recorder in reversed(_query_recorders.get()):
+        execute = functools.partial(recorder, execute)
+    return execute(sql, params, many, context)
+
+
+@contextmanager
+def recording_queries(recorder):
+    """
+    passes the queries of the current context through `recorder`, an execute wrapper, on any connection:
+    sync_to_async runs its function in a copy of the context, so the queries of the async ORM are included
+    """
+    token = _query_recorders.set((*_query_recorders.get(), recorder))
+    try:
+        yield
+    finally:
+        _query_recorders.reset(token)
+
+
+def record_throttle(name, outcome):
+    """
+    counts a request `outcome` ('allowed' or 'rejected') of throttle `name` (blog.throttle)
+    """
+    registry.count_throttle(name, outcome)
+
+
+def record_cache(outcome):
+    """
+    counts a blog.cache hit or miss against the current request
+    """
+    timings = _current.get()
+    if timings is not None:
+        timings.cache[CACHE_OUTCOMES[outcome]] += 1
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        timings = _current.get()
+        if timings is None:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timings.template += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    the Django template backend, timing each render against the current request
+    (includes and extends happen within the top-level render)
+    """
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+class Registry:
+    """
+    the histograms and cache counters of this process, labelled with the URL name of the request
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            # (metric, view): [bucket counts..., sum, count]
+            self.histograms = {}
+            # (view, cache, outcome): count
+            self.cache = Counter()
+            # (throttle, outcome): count
+            self.throttles = Counter()
+
+    def observe(self, view, timings):
+        with self.lock:
+            for metric, (_, buckets, attribute) in HISTOGRAMS.items():
+                value = getattr(timings, attribute)
+                series = self.histograms.setdefault((metric, view), [0] * len(buckets) + [0, 0])
+                for i, bound in enumerate(buckets):
+                    if value <= bound:
+                        series[i] += 1
+                series[-2] += value
+                series[-1] += 1
+            for (cache, outcome), count in timings.cache.items():
+                self.cache[view, cache, outcome] += count
+
+    def count_throttle(self, name, outcome):
+        with self.lock:
+            self.throttles[name, outcome] += 1
+
+    def render(self):
+        """
+        the Prometheus text exposition of every metric
+        """
+        with self.lock:
+            histograms = {key: list(series) for key, series in self.histograms.items()}
+            cache = dict(self.cache)
+            throttles = dict(self.throttles)
+        lines = []
+        for metric, (description, buckets, _) in HISTOGRAMS.items():
+            lines += [f'# HELP {metric} {description}.', f'# TYPE {metric} histogram']
+            for (name, view), series in sorted(histograms.items()):
+                if name != metric:
+                    continue
+                label = f'view="{_escape(view)}"'
+                for bound, count in zip(buckets, series):
+                    lines.append(f'{metric}_bucket{{{label},le="{bound}"}} {count}')
+                lines.append(f'{metric}_bucket{{{label},le="+Inf"}} {series[-1]}')
+                lines.append(f'{metric}_sum{{{label}}} {series[-2]:g}')
+                lines.append(f'{metric}_count{{{label}}} {series[-1]}')
+        lines += ['# HELP blog_cache_requests_total Blog fragment and page cache lookups.', '# TYPE blog_cache_requests_total counter']
+        for (view, cache_name, outcome), count in sorted(cache.items()):
+            lines.append(f'blog_cache_requests_total{{view="{_escape(view)}",cache="{cache_name}",outcome="{outcome}"}} {count}')
+        lines += ['# HELP blog_throttle_requests_total Throttled requests, rejected ones are the work shed.', '# TYPE blog_throttle_requests_total counter']
+        for (name, outcome), count in sorted(throttles.items()):
+            lines.append(f'blog_throttle_requests_total{{throttle="{_escape(name)}",outcome="{outcome}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
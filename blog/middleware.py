@@ -0,0 +1,219 @@
+import logging
+import re
+import time
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.core.handlers.asgi import ASGIRequest
+from django.utils.functional import SimpleLazyObject
+
+from . import auth, metrics, routers
+
+logger = logging.getLogger('blog.queries')
+
+# `IN (%s, %s, %s)` and `VALUES (%s), (%s)` lists collapse to one placeholder so they count as one shape
+PLACEHOLDER_LIST = re.compile(r'%s(?:\s*,\s*%s)+')
+
+
+def query_shape(sql):
+    return PLACEHOLDER_LIST.sub('%s', sql)
+
+
+class RepeatedQueryLogMiddleware:
+    """
+    DEBUG only: logs a warning for each SQL shape run BLOG_REPEATED_QUERY_THRESHOLD (default 3) times
+    or more while handling one request, which is usually an N+1 query from a template or a loop
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.DEBUG:
+            return self.get_response(request)
+
+        shapes = Counter()
+        with self.recording(shapes):
+            response = self.get_response(request)
+        self.report(request, shapes)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.DEBUG:
+            return await self.get_response(request)
+
+        shapes = Counter()
+        with self.recording(shapes):
+            response = await self.get_response(request)
+        self.report(request, shapes)
+        return response
+
+    def recording(self, shapes):
+        def record(execute, sql, params, many, context):
+            shapes[query_shape(sql)] += 1
+            return execute(sql, params, many, context)
+
+        return metrics.recording_queries(record)
+
+    def report(self, request, shapes):
+        threshold = getattr(settings, 'BLOG_REPEATED_QUERY_THRESHOLD', 3)
+        for sql, count in shapes.items():
+            if count >= threshold:
+                logger.warning("%s %s ran the same query %d times: %s", request.method, request.path, count, sql)
+
+
+class AsyncViewsMiddleware:
+    """
+    serves ASGI requests with the URLconf BLOG_ASYNC_URLCONF (the async reader views of blog.async_views),
+    WSGI requests and a BLOG_ASYNC_URLCONF of None keep ROOT_URLCONF
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def route(self, request):
+        urlconf = getattr(settings, 'BLOG_ASYNC_URLCONF', None)
+        if urlconf and isinstance(request, ASGIRequest):
+            request.urlconf = urlconf
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self.route(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        self.route(request)
+        return await self.get_response(request)
+
+
+class PrimaryPinMiddleware:
+    """
+    routes the reads of each request with blog.routers: to a replica, or to the primary for requests that
+    write and for BLOG_DB_PRIMARY_PIN_SECONDS (default 10) after a request of the same client wrote something.
+    Goes before SessionMiddleware so the session is read and saved under the same routing
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def begin(self, request):
+        try:
+            pinned_until = float(request.COOKIES.get(routers.PIN_COOKIE, 0))
+        except ValueError:
+            pinned_until = 0
+        pinned = request.method not in ('GET', 'HEAD', 'OPTIONS') or pinned_until > time.time()
+        return routers.begin_request(pinned)
+
+    def end(self, token, response):
+        if routers.end_request(token):
+            seconds = getattr(settings, 'BLOG_DB_PRIMARY_PIN_SECONDS', 10)
+            response.set_cookie(routers.PIN_COOKIE, str(int(time.time() + seconds)), max_age=seconds, httponly=True, samesite='Lax')
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not routers.replicas():
+            return self.get_response(request)
+        token = self.begin(request)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            routers.end_request(token)
+            raise
+        return self.end(token, response)
+
+    async def __acall__(self, request):
+        if not routers.replicas():
+            return await self.get_response(request)
+        token = self.begin(request)
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            routers.end_request(token)
+            raise
+        return self.end(token, response)
+
+
+class RequestMetricsMiddleware:
+    """
+    measures each request (wall time, SQL queries and their time, template rendering, blog cache hits and
+    misses, see blog.metrics), sends them in a Server-Timing header with BLOG_SERVER_TIMING or DEBUG, and
+    adds them to the histograms of the URL name served at /metrics/. Goes first so the timings cover
+    the other middlewares, session lookup included. A streamed body is not part of the wall time
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def report(self, request, timings, response):
+        timings.finish()
+        match = getattr(request, 'resolver_match', None)
+        metrics.registry.observe(match.view_name if match else '<unresolved>', timings)
+        # the timings tell about the server, not for every client by default
+        if getattr(settings, 'BLOG_SERVER_TIMING', False) or settings.DEBUG:
+            response.headers['Server-Timing'] = timings.server_timing()
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings, token = metrics.begin_request()
+        try:
+            with metrics.recording_queries(timings.record_query):
+                response = self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self.report(request, timings, response)
+
+    async def __acall__(self, request):
+        timings, token = metrics.begin_request()
+        try:
+            with metrics.recording_queries(timings.record_query):
+                response = await self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self.report(request, timings, response)
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    """
+    AuthenticationMiddleware resolving request.user from the cached user snapshot of blog.auth,
+    a logged in user costs no query while its snapshot and session are cached
+    """
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: self.get_user(request))
+        request.auser = lambda: self.aget_user(request)
+
+    @staticmethod
+    def get_user(request):
+        if not hasattr(request, '_cached_user'):
+            request._cached_user = auth.get_user(request)
+        return request._cached_user
+
+    @classmethod
+    async def aget_user(cls, request):
+        # the session and snapshot cache lookups are sync
+        return await sync_to_async(cls.get_user)(request)
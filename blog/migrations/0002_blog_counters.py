@@ -0,0 +1,47 @@
+# Generated by Django 5.0 on 2026-10-18 10:15
+
+import blog.models
+import enumfields.fields
+from django.db import migrations, models
+
+
+def backfill_counters(apps, schema_editor):
+    Blog = apps.get_model('blog', 'Blog')
+    Comment = apps.get_model('blog', 'Comment')
+    Reaction = apps.get_model('blog', 'Reaction')
+    Blog.objects.update(
+        upvote_count=blog.models.count_subquery(Reaction.objects.filter(raection_type='upvote'), 'post'),
+        downvote_count=blog.models.count_subquery(Reaction.objects.filter(raection_type='downvote'), 'post'),
+        comment_count=blog.models.count_subquery(Comment.objects.all(), 'for_blog'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blog',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='blog',
+            name='downvote_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='blog',
+            name='upvote_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='reaction',
+            name='raection_type',
+            field=enumfields.fields.EnumField(enum=blog.models.REACTION_CHOICES, max_length=8),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations
+
+from blog.search import get_search_backend
+
+
+def install_search_index(apps, schema_editor):
+    backend = get_search_backend(schema_editor.connection.alias)
+    backend.install(schema_editor.connection)
+    backend.rebuild(schema_editor.connection)
+
+
+def uninstall_search_index(apps, schema_editor):
+    get_search_backend(schema_editor.connection.alias).uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0002_blog_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
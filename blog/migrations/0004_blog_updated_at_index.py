@@ -0,0 +1,19 @@
+# Generated by Django 5.0 on 2026-10-18 10:28
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0003_blog_search'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='blog',
+            name='updated_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='updated_at'),
+        ),
+    ]
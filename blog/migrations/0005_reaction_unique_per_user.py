@@ -0,0 +1,41 @@
+# Generated by Django 5.0 on 2026-10-18 10:40
+
+import blog.models
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def deduplicate_reactions(apps, schema_editor):
+    """
+    keeps the newest reaction of each (post, user), then recounts the votes of the blogs that had duplicates
+    """
+    Blog = apps.get_model('blog', 'Blog')
+    Reaction = apps.get_model('blog', 'Reaction')
+    db = schema_editor.connection.alias
+    duplicates = Reaction.objects.using(db).values('post', 'user').annotate(newest=Max('pk'), total=models.Count('pk')).filter(total__gt=1)
+    blog_ids = set()
+    for row in duplicates:
+        Reaction.objects.using(db).filter(post=row['post'], user=row['user']).exclude(pk=row['newest']).delete()
+        blog_ids.add(row['post'])
+    if blog_ids:
+        Blog.objects.using(db).filter(pk__in=blog_ids).update(
+            upvote_count=blog.models.count_subquery(Reaction.objects.filter(raection_type='upvote'), 'post'),
+            downvote_count=blog.models.count_subquery(Reaction.objects.filter(raection_type='downvote'), 'post'),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0004_blog_updated_at_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_reactions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='reaction',
+            constraint=models.UniqueConstraint(fields=('post', 'user'), name='unique_reaction_per_user'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.0 on 2026-10-18 10:42
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0005_reaction_unique_per_user'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='blog',
+            options={'ordering': ['-posted_at', '-id']},
+        ),
+        migrations.AlterModelOptions(
+            name='comment',
+            options={'ordering': ['posted_at', 'id']},
+        ),
+        migrations.AlterModelOptions(
+            name='reaction',
+            options={'ordering': ['id']},
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='for_blog',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, to='blog.blog'),
+        ),
+        migrations.AlterField(
+            model_name='reaction',
+            name='post',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='blog.blog'),
+        ),
+        migrations.AddIndex(
+            model_name='blog',
+            index=models.Index(fields=['posted_at', 'id'], name='blog_posted_at_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['for_blog', 'posted_at', 'id'], name='comment_blog_posted_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['for_blog', 'updated_at'], name='comment_blog_updated_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reaction',
+            index=models.Index(fields=['post', 'raection_type'], name='reaction_post_type_idx'),
+        ),
+    ]
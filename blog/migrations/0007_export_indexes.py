@@ -0,0 +1,39 @@
+# Generated by Django 5.0 on 2026-10-18 10:48
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0006_access_pattern_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reaction',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='blog',
+            index=models.Index(fields=['updated_at', 'id'], name='blog_updated_at_id_idx'),
+        ),
+        # the composite index replaces the single column one
+        migrations.AlterField(
+            model_name='blog',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='updated_at'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['updated_at', 'id'], name='comment_updated_at_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reaction',
+            index=models.Index(fields=['updated_at', 'id'], name='reaction_updated_at_id_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.0 on 2026-10-18 11:00
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0008_blog_content_html'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HotScore',
+            fields=[
+                ('blog', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='hot_score', serialize=False, to='blog.blog')),
+                ('score', models.FloatField()),
+                ('scored_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['-score', '-blog'],
+            },
+        ),
+        migrations.AddField(
+            model_name='blog',
+            name='activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='blog',
+            index=models.Index(fields=['activity_at'], name='blog_activity_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hotscore',
+            index=models.Index(fields=['score', 'blog'], name='hotscore_score_blog_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hotscore',
+            index=models.Index(fields=['scored_at'], name='hotscore_scored_at_idx'),
+        ),
+    ]
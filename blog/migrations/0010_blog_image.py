@@ -0,0 +1,33 @@
+# Generated by Django 5.0 on 2026-10-18 11:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0009_hot_scores'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blog',
+            name='image',
+            field=models.ImageField(blank=True, height_field='image_height', upload_to='blog/images/%Y/%m/', width_field='image_width'),
+        ),
+        migrations.AddField(
+            model_name='blog',
+            name='image_height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='blog',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='blog',
+            name='image_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0 on 2026-10-18 11:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0010_blog_image'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReaderSketch',
+            fields=[
+                ('blog', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='reader_sketch', serialize=False, to='blog.blog')),
+                ('registers', models.BinaryField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='blog',
+            name='unique_readers',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='blog',
+            name='view_count',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+    ]
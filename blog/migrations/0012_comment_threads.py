@@ -0,0 +1,58 @@
+# Generated by Django 5.0 on 2026-10-18 11:20
+
+import blog.models
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_threads(apps, schema_editor):
+    """
+    the existing comments are all top-level: their path is their own segment, one thread each
+    """
+    Blog = apps.get_model('blog', 'Blog')
+    Comment = apps.get_model('blog', 'Comment')
+    comments = Comment.objects.filter(path='').order_by('pk').only('pk')
+    while True:
+        batch = list(comments[:1000])
+        if not batch:
+            break
+        for comment in batch:
+            comment.path = blog.models.comment_path_segment(comment.pk)
+        Comment.objects.bulk_update(batch, ['path'])
+    Blog.objects.update(thread_count=blog.models.count_subquery(Comment.objects.filter(parent__isnull=True), 'for_blog'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0011_blog_view_counts'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blog',
+            name='thread_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='parent',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='replies', to='blog.comment'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(default='', editable=False, max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['for_blog', 'path'], name='comment_blog_path_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['parent'], name='comment_parent_idx'),
+        ),
+        migrations.RunPython(backfill_threads, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0 on 2026-10-18 11:32
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0012_comment_threads'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedPost',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('computed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('blog', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='related_posts', to='blog.blog')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='blog.blog')),
+            ],
+            options={
+                'ordering': ['blog', 'rank'],
+                'indexes': [models.Index(fields=['computed_at'], name='relatedpost_computed_at_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='relatedpost',
+            constraint=models.UniqueConstraint(fields=('blog', 'rank'), name='unique_related_post_rank'),
+        ),
+    ]
@@ -1,37 +1,459 @@
-from django.db import models
+from django.db import connections, models, router, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
 from django.contrib.auth.models import User
+from django.dispatch import Signal
 from django.utils import timezone
+from django.utils.http import int_to_base36
 from enumfields import Enum, EnumField
+from .markup import excerpt, render_markdown
+from .search import get_search_backend
 
 # Create your models here
 # class User(models.Model):
 
+def count_subquery(queryset, fk_name):
+    """
+    returns a correlated COUNT(*) of `queryset` rows pointing at the outer blog, 0 when there are none
+    """
+    counts = queryset.filter(**{fk_name: OuterRef('pk')}).order_by().values(fk_name).annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(counts), 0)
+
+def viewer_reaction(viewer, post_ref='pk'):
+    """
+    the raection_type of the vote of `viewer` on the outer blog (`post_ref`), None when they didn't vote
+    """
+    own_vote = Reaction.objects.filter(post=OuterRef(post_ref), user=viewer.pk).values('raection_type')[:1]
+    return Subquery(own_vote, output_field=models.CharField())
+
+class BlogQuerySet(models.QuerySet):
+    def recount_counters(self):
+        """
+        rebuilds upvote_count, downvote_count and comment_count for every blog in the queryset
+        with one UPDATE statement, returns the number of blogs updated
+        """
+        return self.update(
+            upvote_count=count_subquery(Reaction.objects.filter(raection_type=REACTION_CHOICES.up_vote), 'post'),
+            downvote_count=count_subquery(Reaction.objects.filter(raection_type=REACTION_CHOICES.down_vote), 'post'),
+            comment_count=count_subquery(Comment.objects.all(), 'for_blog'),
+            thread_count=count_subquery(Comment.objects.filter(parent__isnull=True), 'for_blog'),
+            activity_at=timezone.now(),
+        )
+
+    def bump_counters(self, **deltas):
+        """
+        applies `deltas` ({counter_field: +n/-n}) to the blogs in the queryset as F() expressions, never going
+        below 0, and touches their activity_at for the hot score refresh. Returns the number of blogs updated
+        """
+        changes = {field: Greatest(F(field) + delta, 0) for field, delta in deltas.items() if delta}
+        if not changes:
+            return 0
+        return self.update(**changes, activity_at=timezone.now())
+
+    def lock(self):
+        """
+        locks the rows of the blogs in the queryset until the end of the transaction, FOR NO KEY UPDATE where
+        the database has it so new comments and votes can still reference them. Returns their ids
+        """
+        no_key = connections[self.db].features.has_select_for_no_key_update
+        return list(self.select_for_update(no_key=no_key).values_list('pk', flat=True))
+
+    def for_feed(self, viewer=None):
+        """
+        the blog cards of the feeds in one statement: the blogs joined with their authors, without their
+        body, with their counters (comment_count, upvote_count, downvote_count) and for a logged in `viewer`
+        their own vote as viewer_reaction ('upvote', 'downvote' or None), a subquery on the unique (post, user) index
+        """
+        queryset = self.select_related('posted_by').defer('content', 'content_html')
+        if viewer is not None and viewer.is_authenticated:
+            queryset = queryset.annotate(viewer_reaction=viewer_reaction(viewer))
+        return queryset
+
+    def search(self, query):
+        """
+        full-text search over title and content, ranked best match first (see blog.search)
+        """
+        query = (query or '').strip()
+        if not query:
+            # with the annotation the callers order by
+            return self.none().annotate(search_rank=models.Value(0.0, output_field=models.FloatField()))
+        return get_search_backend(self.db).search(self, query)
+
 class Blog(models.Model):
     posted_by = models.ForeignKey(User, on_delete=models.DO_NOTHING) # ususally admins but admins also has id
     title = models.CharField(max_length=100)
     content = models.CharField(max_length=1000)
+    # content rendered from Markdown (blog.markup) and its plain text start for the feed, by render_content()
+    # when the content changes, `manage.py render_blog_content` fills them for rows written in bulk
+    content_html = models.TextField(blank=True, default='', editable=False)
+    excerpt = models.CharField(max_length=250, blank=True, default='', editable=False)
+    # optional picture, its resized WebP/JPEG copies are generated after the upload (blog.images)
+    image = models.ImageField(upload_to='blog/images/%Y/%m/', blank=True, width_field='image_width', height_field='image_height')
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    # {format: [[width, storage name], ...]} of the generated copies, empty until they are
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     posted_at = models.DateTimeField("posted_date", default=timezone.now)
+    # touched by save() on every edit, drives the feed's Last-Modified and the incremental export
     updated_at = models.DateTimeField("updated_at", default=timezone.now)
+    # denormalized counters, maintained by blog.signals in the same transaction as the Reaction/Comment write
+    # use `manage.py recount_blog_counters` to rebuild them
+    upvote_count = models.PositiveIntegerField(default=0, editable=False)
+    downvote_count = models.PositiveIntegerField(default=0, editable=False)
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    # the top-level comments, the comment pages are pages of threads
+    thread_count = models.PositiveIntegerField(default=0, editable=False)
+    # touched with every counter update, the blogs `manage.py refresh_hot_scores` has to rescore (blog.hot)
+    activity_at = models.DateTimeField(default=timezone.now, editable=False)
+    # page views and the estimated distinct readers, buffered in the cache and written by `manage.py flush_blog_views`
+    view_count = models.PositiveBigIntegerField(default=0, editable=False)
+    unique_readers = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = BlogQuerySet.as_manager()
+
+    class Meta:
+        # newest first, the feed order, id breaks ties so the order is total
+        ordering = ['-posted_at', '-id']
+        indexes = [
+            # the feed and its keyset pages (scanned backwards for the newest first order)
+            models.Index(fields=['posted_at', 'id'], name='blog_posted_at_id_idx'),
+            # the feed's Last-Modified (MAX(updated_at)) and the incremental export (blog.export)
+            models.Index(fields=['updated_at', 'id'], name='blog_updated_at_id_idx'),
+            # the blogs whose counters changed since the last hot score refresh
+            models.Index(fields=['activity_at'], name='blog_activity_at_idx'),
+        ]
+
+    # the content content_html was rendered from
+    _rendered_content = None
+    # the image the stored image_variants were generated from
+    _stored_image = None
 
     def __str__ (self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        blog = super().from_db(db, field_names, values)
+        # a loaded row is rendered already, unless it was written in bulk
+        if blog.__dict__.get('content_html'):
+            blog._rendered_content = blog.__dict__.get('content')
+        if 'image' in blog.__dict__:
+            blog._stored_image = blog.image.name or None
+        return blog
+
+    def render_content(self):
+        """
+        renders content to content_html and excerpt
+        """
+        self.content_html = render_markdown(self.content)
+        self.excerpt = excerpt(self.content_html)
+        self._rendered_content = self.content
+
+    def save(self, *args, **kwargs):
+        """
+        overridden to touch updated_at when an existing blog is edited, it drives the page validators,
+        and to render the content when it changed (BlogForm renders it already)
+        """
+        update_fields = kwargs.get('update_fields')
+        if not self._state.adding and (update_fields is None or 'updated_at' in update_fields):
+            self.updated_at = timezone.now()
+        if 'content' not in self.get_deferred_fields() and (update_fields is None or 'content' in update_fields):
+            if self._rendered_content != self.content:
+                self.render_content()
+                if update_fields is not None:
+                    kwargs['update_fields'] = {*update_fields, 'content_html', 'excerpt'}
+        # a new image: the copies of the old one go, blog.signals has the new ones generated once committed
+        self._replaced_variants = None
+        if 'image' not in self.get_deferred_fields() and (update_fields is None or 'image' in update_fields):
+            if self._stored_image != (self.image.name or None) or (self.image and not self.image._committed):
+                self._replaced_variants = self.image_variants
+                self.image_variants = {}
+                if update_fields is not None:
+                    kwargs['update_fields'] = {*kwargs['update_fields'], 'image_variants', 'image_width', 'image_height'}
+        super().save(*args, **kwargs)
+        self._stored_image = self.image.name or None
+
+# a comment's path is the path of its parent followed by its own id in base 36, zero padded to
+# COMMENT_PATH_SEGMENT digits: sorting on it lists every thread with each reply right after its parent,
+# and the replies of a comment are the range [path, comment_path_end(path))
+COMMENT_PATH_SEGMENT = 8
+# replies to a comment this deep go next to it instead
+COMMENT_MAX_DEPTH = 8
+
+def comment_path_segment(pk):
+    return int_to_base36(pk).zfill(COMMENT_PATH_SEGMENT)
+
+def comment_path_end(path):
+    """
+    the path right after the subtree of `path`, its last segment + 1 (only [0-9a-z] so any collation sorts them alike)
+    """
+    return path[:-COMMENT_PATH_SEGMENT] + comment_path_segment(int(path[-COMMENT_PATH_SEGMENT:], 36) + 1)
+
+def reply_position(parent_id, parent_path):
+    """
+    the (parent id, parent path) a reply to comment `parent_id` goes under: a reply to a comment at
+    COMMENT_MAX_DEPTH becomes a reply to its parent, next to it
+    """
+    if len(parent_path) >= COMMENT_PATH_SEGMENT * COMMENT_MAX_DEPTH:
+        parent_path = parent_path[:-COMMENT_PATH_SEGMENT]
+        parent_id = int(parent_path[-COMMENT_PATH_SEGMENT:], 36)
+    return parent_id, parent_path
+
+# sent by CommentQuerySet.delete_thread() inside its transaction, the bulk delete sends no post_delete
+comments_deleted = Signal()
+
+class CommentQuerySet(models.QuerySet):
+    def delete_thread(self, comment):
+        """
+        deletes `comment` and all its replies with one DELETE on the path range of the thread, the blog's
+        counters go down by as many in the same transaction. Returns the number deleted
+        A comment written in bulk and still without a path goes through the regular delete (the cascade through parent)
+        """
+        using = self._db or router.db_for_write(self.model, instance=comment)
+        if not comment.path:
+            return self.using(using).filter(pk=comment.pk).delete()[0]
+        opts = self.model._meta
+        quote = connections[using].ops.quote_name
+        path = quote(opts.get_field('path').column)
+        # no collector: the cascade through parent would fetch the thread level by level and
+        # send a post_delete (and a counter update) per comment
+        sql = f"DELETE FROM {quote(opts.db_table)} WHERE {quote(opts.get_field('for_blog').column)} = %s AND {path} >= %s AND {path} < %s"
+        with transaction.atomic(using=using):
+            with connections[using].cursor() as cursor:
+                cursor.execute(sql, [comment.for_blog_id, comment.path, comment_path_end(comment.path)])
+                deleted = cursor.rowcount
+            # deltas rather than a recount, which could miss a comment committed while it waits for the row lock
+            threads = 1 if deleted and len(comment.path) == COMMENT_PATH_SEGMENT else 0
+            Blog.objects.using(using).filter(pk=comment.for_blog_id).bump_counters(comment_count=-deleted, thread_count=-threads)
+            comments_deleted.send(sender=self.model, blog_id=comment.for_blog_id, path=comment.path, deleted=deleted)
+        return deleted
+
+    def fill_paths(self, batch_size=1000):
+        """
+        sets the path of the comments written without one (bulk_create skips save()) in id order,
+        so a parent is done before its replies, moving the replies past COMMENT_MAX_DEPTH up like save() does.
+        Returns the number of comments updated
+        """
+        rows = self.filter(path='').order_by('pk')
+        filled = 0
+        while True:
+            batch = list(rows.only('pk', 'parent')[:batch_size])
+            if not batch:
+                return filled
+            paths = dict(self.filter(pk__in={c.parent_id for c in batch if c.parent_id}).values_list('pk', 'path'))
+            for comment in batch:
+                parent_path = ''
+                if comment.parent_id:
+                    comment.parent_id, parent_path = reply_position(comment.parent_id, paths.get(comment.parent_id, ''))
+                comment.path = paths[comment.pk] = parent_path + comment_path_segment(comment.pk)
+            self.bulk_update(batch, ['path', 'parent'])
+            filled += len(batch)
+
 class Comment(models.Model):
     posted_by = models.ForeignKey(User, on_delete=models.CASCADE)
-    for_blog = models.ForeignKey(Blog, on_delete=models.DO_NOTHING)
+    # no single column index, the composite indexes below start with for_blog
+    for_blog = models.ForeignKey(Blog, on_delete=models.DO_NOTHING, db_index=False)
+    # the comment replied to, None for a top-level comment
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies', db_index=False)
+    path = models.CharField(max_length=COMMENT_PATH_SEGMENT * COMMENT_MAX_DEPTH, default='', editable=False)
     content = models.CharField(max_length=1000)
     posted_at = models.DateTimeField("posted_date", default=timezone.now)
     updated_at = models.DateTimeField("posted_date", default=timezone.now)
 
+    objects = CommentQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['posted_at', 'id']
+        indexes = [
+            # the comment list of the API, oldest first
+            models.Index(fields=['for_blog', 'posted_at', 'id'], name='comment_blog_posted_at_idx'),
+            # the pages of threads of a blog and the thread deletes (path ranges)
+            models.Index(fields=['for_blog', 'path'], name='comment_blog_path_idx'),
+            # the replies of a comment, for the parent cascade
+            models.Index(fields=['parent'], name='comment_parent_idx'),
+            # the newest comment of a blog for the page validators (MAX(updated_at))
+            models.Index(fields=['for_blog', 'updated_at'], name='comment_blog_updated_at_idx'),
+            # the incremental export (blog.export)
+            models.Index(fields=['updated_at', 'id'], name='comment_updated_at_id_idx'),
+        ]
+
     def __str__(self):
         return self.content
 
+    @property
+    def depth(self):
+        """
+        0 for a top-level comment, 1 for a reply to it...
+        """
+        return max(len(self.path) // COMMENT_PATH_SEGMENT - 1, 0)
+
+    def save(self, *args, **kwargs):
+        """
+        wrapped in a transaction so the comment_count update done by the post_save handler commits with the row,
+        a new comment gets its path once it has its id
+        """
+        adding = self._state.adding and not self.path
+        parent_path = ''
+        if adding and self.parent_id:
+            self.parent_id, parent_path = reply_position(self.parent_id, self.parent.path)
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            if adding:
+                self.path = parent_path + comment_path_segment(self.pk)
+                type(self)._base_manager.using(self._state.db).filter(pk=self.pk).update(path=self.path)
+
 class REACTION_CHOICES(Enum):
     up_vote = 'upvote'
     down_vote = 'downvote'
 
+# the Blog counter column each reaction type is counted in
+REACTION_COUNTER_FIELDS = {
+    REACTION_CHOICES.up_vote: 'upvote_count',
+    REACTION_CHOICES.down_vote: 'downvote_count',
+}
+
+# sent by ReactionQuerySet.set_reaction() inside its transaction, the upsert sends no post_save
+reaction_set = Signal()
+
+class ReactionQuerySet(models.QuerySet):
+    def set_reaction(self, post, user, raection_type):
+        """
+        sets the vote of `user` on `post` (instances or ids) to `raection_type`, None removes it
+        A vote is one INSERT ... ON CONFLICT (post, user) DO UPDATE, so concurrent clicks can't add a
+        second row, followed by the recount of the blog's counters in the same transaction. The blog row is
+        locked first: the recount runs once the competing counter updates committed and sees their rows.
+        Removing a vote is a regular delete (post_delete keeps the counters).
+        Returns the Reaction written, or None. Raises ValueError for a type that isn't a REACTION_CHOICES
+        """
+        post_id = getattr(post, 'pk', post)
+        user_id = getattr(user, 'pk', user)
+        if raection_type is None:
+            self.filter(post=post_id, user=user_id).delete()
+            return None
+        try:
+            raection_type = REACTION_CHOICES(raection_type)
+        except ValueError:
+            raise ValueError(f"unknown reaction type {raection_type!r}, expected one of {', '.join(choice.value for choice in REACTION_CHOICES)}")
+        reaction = self.model(post_id=post_id, user_id=user_id, raection_type=raection_type)
+        with transaction.atomic(using=self.db):
+            Blog.objects.using(self.db).filter(pk=post_id).lock()
+            self.bulk_create([reaction], update_conflicts=True, unique_fields=['post', 'user'], update_fields=['raection_type', 'updated_at'])
+            Blog.objects.using(self.db).filter(pk=post_id).recount_counters()
+            reaction_set.send(sender=self.model, post_id=post_id, user_id=user_id, raection_type=reaction.raection_type)
+        return reaction
+
 class Reaction(models.Model):
-    post = models.ForeignKey(Blog, on_delete=models.CASCADE)
+    # no single column index, unique_reaction_per_user and reaction_post_type_idx start with post
+    post = models.ForeignKey(Blog, on_delete=models.CASCADE, db_index=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     raection_type = EnumField(REACTION_CHOICES, max_length=8)
-    created_at = models.DateField(auto_now_add=True)
\ No newline at end of file
+    created_at = models.DateField(auto_now_add=True)
+    # a vote flip changes the row, the incremental export picks it up
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ReactionQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['id']
+        constraints = [
+            # one vote per user and blog, set_reaction() upserts on it
+            models.UniqueConstraint(fields=['post', 'user'], name='unique_reaction_per_user'),
+        ]
+        indexes = [
+            # the per type vote counts of a blog (recount_counters)
+            models.Index(fields=['post', 'raection_type'], name='reaction_post_type_idx'),
+            # the incremental export (blog.export)
+            models.Index(fields=['updated_at', 'id'], name='reaction_updated_at_id_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        remembers the stored reaction type so a vote flip can move the count from one counter to the other
+        """
+        instance = super().from_db(db, field_names, values)
+        instance._stored_raection_type = instance.__dict__.get('raection_type')
+        return instance
+
+    def save(self, *args, **kwargs):
+        """
+        wrapped in a transaction so the counter update done by the post_save handler commits with the row
+        """
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+
+class HotScore(models.Model):
+    """
+    the hot ranking of a blog (blog.hot), precomputed by `manage.py refresh_hot_scores`
+    """
+    blog = models.OneToOneField(Blog, on_delete=models.CASCADE, primary_key=True, related_name='hot_score')
+    score = models.FloatField()
+    # start of the refresh that wrote the score, the latest one is where the next refresh starts
+    scored_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-score', '-blog']
+        indexes = [
+            # the /hot/ pages (scanned backwards for the highest scores first)
+            models.Index(fields=['score', 'blog'], name='hotscore_score_blog_idx'),
+            models.Index(fields=['scored_at'], name='hotscore_scored_at_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.blog_id}: {self.score}'
+
+
+class ReaderSketch(models.Model):
+    """
+    the HyperLogLog sketch of the readers of a blog (blog.pageviews), Blog.unique_readers is its estimate
+    """
+    blog = models.OneToOneField(Blog, on_delete=models.CASCADE, primary_key=True, related_name='reader_sketch')
+    registers = models.BinaryField()
+
+    def __str__(self):
+        return f'{self.blog_id}: {len(self.registers)} registers'
+
+
+class RelatedPost(models.Model):
+    """
+    a blog similar to another by the TF-IDF of their text (blog.related), precomputed by `manage.py build_related_posts`
+    """
+    # no single column index, unique_related_post_rank starts with blog
+    blog = models.ForeignKey(Blog, on_delete=models.CASCADE, db_index=False, related_name='related_posts')
+    related = models.ForeignKey(Blog, on_delete=models.CASCADE, related_name='+')
+    # 1 for the most similar
+    rank = models.PositiveSmallIntegerField()
+    # cosine similarity of the TF-IDF vectors, in (0, 1]
+    score = models.FloatField()
+    # start of the build that wrote the row, the latest one is where the next incremental build starts
+    computed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['blog', 'rank']
+        constraints = [
+            # the related posts of a blog page, in rank order from the index
+            models.UniqueConstraint(fields=['blog', 'rank'], name='unique_related_post_rank'),
+        ]
+        indexes = [
+            models.Index(fields=['computed_at'], name='relatedpost_computed_at_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.blog_id} -> {self.related_id}: {self.score}'
+
+
+class ImportCheckpoint(models.Model):
+    """
+    the progress of a `manage.py import_blog` run, written in the transaction of each chunk it imports:
+    a resumed import continues right after the committed records, whether or not they carry an id
+    """
+    # the --checkpoint name, the input path by default
+    name = models.CharField(max_length=255, unique=True)
+    model = models.CharField(max_length=20)
+    records = models.PositiveBigIntegerField(default=0)
+    rows = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name}: {self.records} {self.model} records'
@@ -0,0 +1,257 @@
+import collections.abc
+import datetime
+import math
+
+from django.core import signing
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections
+from django.db.models import F, Q, Subquery
+from django.http import QueryDict
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def estimated_count(queryset):
+    """
+    cheap row count estimate for an unfiltered table (planner statistics on PostgreSQL),
+    returns None when there is no cheap estimate so the total is just not shown
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql' or queryset.query.where:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [queryset.model._meta.db_table])
+        row = cursor.fetchone()
+    # reltuples is -1 for a table that was never analyzed
+    return row[0] if row and row[0] >= 0 else None
+
+
+class CursorPaginator:
+    """
+    Keyset (cursor) paginator, a page is fetched with `WHERE (ordering columns) > last seen row LIMIT n`
+    so page N costs the same as page 1 and no COUNT(*) is run.
+
+    The last field of `ordering` must be unique (the primary key) so the order is total.
+    Cursors are signed, a tampered or foreign cursor falls back to the first page like Paginator.get_page()
+    `count` is optional: pass a known count (e.g. Blog.comment_count) or an estimate to show a page total.
+    """
+    def __init__(self, object_list, per_page, ordering=('-posted_at', '-id'), count=None, count_is_estimate=False):
+        self.object_list = object_list.order_by(*ordering)
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.fields = [(name.lstrip('-'), name.startswith('-')) for name in self.ordering]
+        self.count = count
+        self.count_is_estimate = count_is_estimate
+        self.salt = f"blog.pagination:{self.object_list.model._meta.label}:{','.join(self.ordering)}"
+
+    @property
+    def num_pages(self):
+        if self.count is None:
+            return None
+        return max(1, math.ceil(self.count / self.per_page))
+
+    def encode_cursor(self, obj, number):
+        values = []
+        for name, _ in self.fields:
+            # rows of a values() queryset are dicts
+            value = obj[name] if isinstance(obj, dict) else getattr(obj, name)
+            values.append(value.isoformat() if isinstance(value, (datetime.date, datetime.time)) else value)
+        return signing.dumps({'v': values, 'n': number}, salt=self.salt, compress=True)
+
+    def decode_cursor(self, cursor):
+        try:
+            payload = signing.loads(cursor, salt=self.salt)
+            raw_values, number = payload['v'], int(payload['n'])
+        except (signing.BadSignature, KeyError, TypeError, ValueError):
+            raise InvalidCursor(cursor)
+        if len(raw_values) != len(self.fields):
+            raise InvalidCursor(cursor)
+        opts = self.object_list.model._meta
+        values = []
+        for (name, _), value in zip(self.fields, raw_values):
+            try:
+                field = opts.pk if name == 'pk' else opts.get_field(name)
+            except FieldDoesNotExist:
+                # an annotation such as search_rank, JSON already gives back the right type
+                values.append(value)
+            else:
+                values.append(field.to_python(value))
+        return values, max(number, 1)
+
+    def _keyset_q(self, values, forward):
+        """
+        rows strictly after `values` in the paginator ordering (strictly before when not forward),
+        the extra non-strict bound on the first column lets the database use a range scan on its index
+        """
+        rows_after = Q()
+        equal = Q()
+        for (name, descending), value in zip(self.fields, values):
+            # going forward on a descending column (or backward on an ascending one) means smaller values
+            lookup = 'lt' if descending == forward else 'gt'
+            rows_after |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        first_name, first_descending = self.fields[0]
+        bound = Q(**{f"{first_name}__{'lte' if first_descending == forward else 'gte'}": values[0]})
+        return bound & rows_after
+
+    def _page_queryset(self, after, before):
+        """
+        the query for a page: (queryset fetching one row more than the page, page number, reversed)
+        raises InvalidCursor for a cursor that can't be verified
+        """
+        if before:
+            values, number = self.decode_cursor(before)
+            reverse_ordering = [name[1:] if name.startswith('-') else f'-{name}' for name in self.ordering]
+            return self.object_list.filter(self._keyset_q(values, forward=False)).order_by(*reverse_ordering)[:self.per_page + 1], number, True
+        queryset, number = self.object_list, 1
+        if after:
+            values, number = self.decode_cursor(after)
+            queryset = queryset.filter(self._keyset_q(values, forward=True))
+        return queryset[:self.per_page + 1], number, False
+
+    def _build_page(self, rows, number, reversed_rows, after, params):
+        if reversed_rows:
+            has_previous = len(rows) > self.per_page
+            return CursorPage(rows[:self.per_page][::-1], number, self, has_next=True, has_previous=has_previous, params=params)
+        return CursorPage(rows[:self.per_page], number, self, has_next=len(rows) > self.per_page, has_previous=bool(after), params=params)
+
+    def page(self, after=None, before=None, params=None):
+        """
+        returns the page following the `after` cursor, preceding the `before` cursor, or the first page
+        raises InvalidCursor for a cursor that can't be verified
+        """
+        queryset, number, reversed_rows = self._page_queryset(after, before)
+        return self._build_page(list(queryset), number, reversed_rows, after, params)
+
+    async def apage(self, after=None, before=None, params=None):
+        """
+        async version of page(), the rows are fetched with async iteration
+        """
+        queryset, number, reversed_rows = self._page_queryset(after, before)
+        return self._build_page([row async for row in queryset], number, reversed_rows, after, params)
+
+    def get_page(self, params):
+        """
+        returns the page for the `after`/`before` cursor in `params` (request.GET),
+        the first page when the cursor is missing or invalid
+        """
+        try:
+            return self.page(after=params.get('after'), before=params.get('before'), params=params)
+        except InvalidCursor:
+            return self.page(params=params)
+
+    async def aget_page(self, params):
+        """
+        async version of get_page()
+        """
+        try:
+            return await self.apage(after=params.get('after'), before=params.get('before'), params=params)
+        except InvalidCursor:
+            return await self.apage(params=params)
+
+
+class ThreadPaginator(CursorPaginator):
+    """
+    Keyset paginator over the threads of a tree stored as materialized paths: a `path` column made of
+    fixed length segments (`segment_length`) and a `parent` foreign key, null on the top-level rows.
+    A page is `per_page` top-level rows, each followed by all its replies in path order, fetched with
+    one range query on path: the end of the range (the path of the first thread of the next page)
+    comes from a subquery of the same query. Cursors hold the path of a top-level row,
+    `count` is the number of threads.
+    """
+    def __init__(self, object_list, per_page, segment_length, path_end, count=None, count_is_estimate=False):
+        super().__init__(object_list, per_page, ordering=('path',), count=count, count_is_estimate=count_is_estimate)
+        self.segment_length = segment_length
+        # path_end(path) is the first path after the subtree of `path`
+        self.path_end = path_end
+        self.threads = self.object_list.filter(parent__isnull=True)
+
+    def encode_cursor(self, obj, number):
+        # the thread the row belongs to
+        return signing.dumps({'v': [obj.path[:self.segment_length]], 'n': number}, salt=self.salt, compress=True)
+
+    def _page_queryset(self, after, before):
+        if before:
+            values, number = self.decode_cursor(before)
+            # the first thread of the page, None when fewer than per_page threads come before
+            start = Subquery(self.threads.filter(path__lt=values[0]).order_by('-path').values('path')[self.per_page - 1:self.per_page])
+            rows = self.object_list.filter(path__lt=values[0]).annotate(page_start=start)
+            return rows.filter(Q(path__gte=F('page_start')) | Q(page_start__isnull=True)), number, True
+        start, number = '', 1
+        if after:
+            values, number = self.decode_cursor(after)
+            start = self.path_end(values[0])
+        # the first thread of the next page, None on the last page
+        end = Subquery(self.threads.filter(path__gte=start).values('path')[self.per_page:self.per_page + 1])
+        rows = self.object_list.filter(path__gte=start).annotate(page_end=end)
+        return rows.filter(Q(path__lt=F('page_end')) | Q(page_end__isnull=True)), number, False
+
+    def _build_page(self, rows, number, reversed_rows, after, params):
+        if reversed_rows:
+            if not rows or rows[0].page_start is None:
+                # back to the first page
+                return CursorPage(rows, 1, self, has_next=True, has_previous=False, params=params)
+            return CursorPage(rows, number, self, has_next=True, has_previous=number > 1, params=params)
+        return CursorPage(rows, number, self, has_next=bool(rows) and rows[0].page_end is not None, has_previous=bool(after), params=params)
+
+
+class CursorPage(collections.abc.Sequence):
+    def __init__(self, object_list, number, paginator, has_next, has_previous, params=None):
+        self.object_list = object_list
+        self.number = number
+        self.paginator = paginator
+        self._has_next = has_next and bool(object_list)
+        self._has_previous = has_previous and bool(object_list)
+        self.params = params
+
+    def __repr__(self):
+        return f'<CursorPage {self.number}>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @property
+    def next_cursor(self):
+        return self.paginator.encode_cursor(self.object_list[-1], self.number + 1) if self.has_next() else None
+
+    @property
+    def previous_cursor(self):
+        return self.paginator.encode_cursor(self.object_list[0], self.number - 1) if self.has_previous() else None
+
+    def _querystring(self, **cursor):
+        """
+        the current query string (e.g. ?search=) with the cursor parameters replaced
+        """
+        params = self.params.copy() if self.params is not None else QueryDict(mutable=True)
+        for key in ('after', 'before', 'page'):
+            params.pop(key, None)
+        params.update(cursor)
+        return params.urlencode()
+
+    @property
+    def first_querystring(self):
+        return self._querystring()
+
+    @property
+    def next_querystring(self):
+        return self._querystring(after=self.next_cursor)
+
+    @property
+    def previous_querystring(self):
+        if self.number <= 2:
+            return self._querystring()
+        return self._querystring(before=self.previous_cursor)
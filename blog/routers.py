@@ -0,0 +1,70 @@
+"""
+Primary / read-replica database routing
+
+Writes always go to the primary (`default`). Within a request (see blog.middleware.PrimaryPinMiddleware)
+reads go to one replica of BLOG_DB_REPLICAS picked for the whole request, except:
+
+- in requests that aren't GET/HEAD/OPTIONS (the comment, reaction, edit, account and signup forms),
+- after the request wrote anything, and in a transaction on the primary,
+- for BLOG_DB_PRIMARY_PIN_SECONDS after a request of the same client wrote something (read-your-writes):
+  the middleware sets the PIN_COOKIE cookie, so the client sees its own comment even when the replica lags.
+
+Outside a request (management commands, shell) everything stays on the primary.
+With no replica configured every query goes to `default`, as without the router.
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_COOKIE = 'blog_primary_until'
+
+# {'replica': alias or None, 'pinned': bool, 'wrote': bool} of the current request
+_request_state = ContextVar('blog_db_request_state', default=None)
+
+
+def replicas():
+    return list(getattr(settings, 'BLOG_DB_REPLICAS', []))
+
+
+def begin_request(pinned):
+    """
+    starts routing the reads of a request, to the primary when `pinned`, returns the token for end_request()
+    """
+    aliases = replicas()
+    state = {'replica': random.choice(aliases) if aliases else None, 'pinned': pinned, 'wrote': False}
+    return _request_state.set(state)
+
+
+def end_request(token):
+    """
+    stops routing the reads of a request, returns whether it wrote to the primary
+    """
+    state = _request_state.get()
+    _request_state.reset(token)
+    return state['wrote']
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _request_state.get()
+        if state is None or state['replica'] is None or state['pinned']:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            # reads within a transaction see its writes
+            return DEFAULT_DB_ALIAS
+        return state['replica']
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state['pinned'] = state['wrote'] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
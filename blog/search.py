@@ -0,0 +1,164 @@
+"""
+Full-text search backends behind Blog.objects.search()
+
+The backend is picked from the database vendor, or from the BLOG_SEARCH_BACKEND setting
+(dotted path to a backend class) when it is set. Every backend exposes:
+- search(queryset, query): filters the queryset to matching blogs, annotated with `search_rank` and ordered by it
+- install(connection): idempotently creates the index structures, called from migration 0003 and post_migrate
+- rebuild(connection): re-indexes every existing blog
+"""
+from django.conf import settings
+from django.db import connections
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+
+class LikeSearchBackend:
+    """
+    fallback for databases without full-text support, unranked substring match (sequential scan)
+    """
+    def search(self, queryset, query):
+        matches = queryset.filter(Q(title__icontains=query) | Q(content__icontains=query))
+        return matches.annotate(search_rank=Value(0.0, output_field=FloatField())).order_by('-posted_at')
+
+    def install(self, connection):
+        pass
+
+    def rebuild(self, connection):
+        pass
+
+    def uninstall(self, connection):
+        pass
+
+
+class PostgresSearchBackend:
+    """
+    `search_vector` tsvector column on blog_blog with a GIN index, kept up to date by a trigger
+    that only fires when title or content are written. title is weighted A and content B
+    """
+    config = 'english'
+    document_sql = (
+        "setweight(to_tsvector('{config}', coalesce({row}.title, '')), 'A') || "
+        "setweight(to_tsvector('{config}', coalesce({row}.content, '')), 'B')"
+    )
+
+    def search(self, queryset, query):
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField
+
+        table = queryset.model._meta.db_table
+        document = RawSQL(f'{table}.search_vector', [], output_field=SearchVectorField())
+        search_query = SearchQuery(query, config=self.config, search_type='websearch')
+        return (
+            queryset.alias(document=document)
+            .filter(document=search_query)
+            .annotate(search_rank=SearchRank(document, search_query))
+            .order_by('-search_rank', '-posted_at')
+        )
+
+    def install(self, connection):
+        document = self.document_sql.format(config=self.config, row='NEW')
+        with connection.cursor() as cursor:
+            cursor.execute("ALTER TABLE blog_blog ADD COLUMN IF NOT EXISTS search_vector tsvector")
+            cursor.execute(
+                "CREATE OR REPLACE FUNCTION blog_blog_search_vector_update() RETURNS trigger AS $$ "
+                f"BEGIN NEW.search_vector := {document}; RETURN NEW; END "
+                "$$ LANGUAGE plpgsql"
+            )
+            cursor.execute("DROP TRIGGER IF EXISTS blog_blog_search_vector_trigger ON blog_blog")
+            cursor.execute(
+                "CREATE TRIGGER blog_blog_search_vector_trigger "
+                "BEFORE INSERT OR UPDATE OF title, content ON blog_blog "
+                "FOR EACH ROW EXECUTE FUNCTION blog_blog_search_vector_update()"
+            )
+            cursor.execute("CREATE INDEX IF NOT EXISTS blog_blog_search_vector_gin ON blog_blog USING gin (search_vector)")
+
+    def rebuild(self, connection):
+        document = self.document_sql.format(config=self.config, row='blog_blog')
+        with connection.cursor() as cursor:
+            cursor.execute(f"UPDATE blog_blog SET search_vector = {document}")
+
+    def uninstall(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TRIGGER IF EXISTS blog_blog_search_vector_trigger ON blog_blog")
+            cursor.execute("DROP FUNCTION IF EXISTS blog_blog_search_vector_update()")
+            cursor.execute("ALTER TABLE blog_blog DROP COLUMN IF EXISTS search_vector")
+
+
+class SqliteSearchBackend:
+    """
+    external-content FTS5 table `blog_blog_fts` kept in sync by triggers, ranked with bm25()
+    with the title column weighted above content
+    """
+    title_weight = 10.0
+    content_weight = 1.0
+
+    triggers = {
+        'blog_blog_fts_insert': (
+            "AFTER INSERT ON blog_blog BEGIN "
+            "INSERT INTO blog_blog_fts(rowid, title, content) VALUES (new.id, new.title, new.content); END"
+        ),
+        'blog_blog_fts_delete': (
+            "AFTER DELETE ON blog_blog BEGIN "
+            "INSERT INTO blog_blog_fts(blog_blog_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content); END"
+        ),
+        # only title/content updates re-index, counter updates on the blog row don't touch the FTS table
+        'blog_blog_fts_update': (
+            "AFTER UPDATE OF title, content ON blog_blog BEGIN "
+            "INSERT INTO blog_blog_fts(blog_blog_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content); "
+            "INSERT INTO blog_blog_fts(rowid, title, content) VALUES (new.id, new.title, new.content); END"
+        ),
+    }
+
+    @staticmethod
+    def match_expression(query):
+        # every term is quoted so FTS5 operators and punctuation typed by the user can't break the MATCH syntax
+        return ' '.join('"%s"' % term.replace('"', '""') for term in query.split())
+
+    def search(self, queryset, query):
+        match = self.match_expression(query)
+        table = queryset.model._meta.db_table
+        matching_ids = RawSQL(f"SELECT rowid FROM {table}_fts WHERE {table}_fts MATCH %s", [match])
+        # bm25() is lower for better matches, negate it so every backend orders by -search_rank
+        rank = RawSQL(
+            f"SELECT -bm25({table}_fts, %s, %s) FROM {table}_fts WHERE {table}_fts MATCH %s AND rowid = {table}.id",
+            [self.title_weight, self.content_weight, match],
+            output_field=FloatField(),
+        )
+        return queryset.filter(pk__in=matching_ids).annotate(search_rank=rank).order_by('-search_rank', '-posted_at')
+
+    def install(self, connection):
+        """
+        the triggers are dropped whenever Django remakes blog_blog during a migration on SQLite,
+        so this is also run on post_migrate to put them back
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS blog_blog_fts "
+                "USING fts5(title, content, content='blog_blog', content_rowid='id')"
+            )
+            for name, body in self.triggers.items():
+                cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+
+    def rebuild(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO blog_blog_fts(blog_blog_fts) VALUES ('rebuild')")
+
+    def uninstall(self, connection):
+        with connection.cursor() as cursor:
+            for name in self.triggers:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+            cursor.execute("DROP TABLE IF EXISTS blog_blog_fts")
+
+
+VENDOR_BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SqliteSearchBackend,
+}
+
+
+def get_search_backend(using='default'):
+    backend_path = getattr(settings, 'BLOG_SEARCH_BACKEND', None)
+    if backend_path:
+        return import_string(backend_path)()
+    return VENDOR_BACKENDS.get(connections[using].vendor, LikeSearchBackend)()
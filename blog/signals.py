@@ -0,0 +1,133 @@
+from django.db import connections, transaction
+from django.db.migrations.recorder import MigrationRecorder
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete, post_migrate
+from django.dispatch import receiver
+from .models import Blog, Comment, Reaction, REACTION_COUNTER_FIELDS, comments_deleted, reaction_set
+from .search import get_search_backend
+from .cache import bump_blog_version, bump_feed_version
+from .images import delete_files, schedule_variants
+from .auth import USER_FIELDS, forget_user
+
+SEARCH_MIGRATION = ('blog', '0003_blog_search')
+
+
+def _bump(blog_id, **deltas):
+    """
+    applies `deltas` ({counter_field: +1/-1}) to one blog row (see BlogQuerySet.bump_counters)
+    """
+    Blog.objects.filter(pk=blog_id).bump_counters(**deltas)
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    if created and not kwargs.get('raw'):
+        _bump(instance.for_blog_id, comment_count=1, thread_count=0 if instance.parent_id else 1)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    # post_delete is sent inside the deletion transaction
+    _bump(instance.for_blog_id, comment_count=-1, thread_count=0 if instance.parent_id else -1)
+
+
+@receiver(post_save, sender=Reaction)
+def reaction_saved(sender, instance, created, **kwargs):
+    if kwargs.get('raw'):
+        return
+    new_field = REACTION_COUNTER_FIELDS[instance.raection_type]
+    if created:
+        _bump(instance.post_id, **{new_field: 1})
+    else:
+        old_type = getattr(instance, '_stored_raection_type', None)
+        if old_type is not None and old_type != instance.raection_type:
+            # vote flip, move the vote from one counter to the other
+            _bump(instance.post_id, **{REACTION_COUNTER_FIELDS[old_type]: -1, new_field: 1})
+    instance._stored_raection_type = instance.raection_type
+
+
+@receiver(post_delete, sender=Reaction)
+def reaction_deleted(sender, instance, **kwargs):
+    stored_type = getattr(instance, '_stored_raection_type', None) or instance.raection_type
+    _bump(instance.post_id, **{REACTION_COUNTER_FIELDS[stored_type]: -1})
+
+
+def _bump_now_and_on_commit(bump, *args):
+    bump(*args)
+    # bumped again once committed, a reader may have cached the old rows under the new version meanwhile
+    transaction.on_commit(lambda: bump(*args))
+
+
+def _invalidate_fragments(blog_id):
+    _bump_now_and_on_commit(bump_blog_version, blog_id)
+
+
+def _invalidate_feed():
+    # the feed cards show the counters and the viewer's vote
+    _bump_now_and_on_commit(bump_feed_version)
+
+
+@receiver([post_save, post_delete], sender=Blog)
+def blog_changed(sender, instance, **kwargs):
+    _invalidate_fragments(instance.pk)
+    _invalidate_feed()
+
+
+@receiver(post_save, sender=Blog)
+def blog_image_saved(sender, instance, raw=False, **kwargs):
+    # Blog.save() leaves the copies of a replaced image in _replaced_variants
+    replaced = getattr(instance, '_replaced_variants', None)
+    if replaced is not None and not raw:
+        schedule_variants(instance.pk, replaced)
+
+
+@receiver(post_delete, sender=Blog)
+def blog_image_deleted(sender, instance, **kwargs):
+    if instance.image or instance.image_variants:
+        delete_files(instance)
+
+
+@receiver([post_save, post_delete], sender=Comment)
+def blog_comment_changed(sender, instance, **kwargs):
+    _invalidate_fragments(instance.for_blog_id)
+    _invalidate_feed()
+
+
+@receiver([post_save, post_delete], sender=Reaction)
+def blog_reaction_changed(sender, instance, **kwargs):
+    _invalidate_fragments(instance.post_id)
+    _invalidate_feed()
+
+
+@receiver(comments_deleted, sender=Comment)
+def blog_thread_deleted(sender, blog_id, **kwargs):
+    # delete_thread() already updated the counters
+    _invalidate_fragments(blog_id)
+    _invalidate_feed()
+
+
+@receiver(reaction_set, sender=Reaction)
+def blog_reaction_set(sender, post_id, **kwargs):
+    # set_reaction() already recounted the counters
+    _invalidate_fragments(post_id)
+    _invalidate_feed()
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    # login() saves last_login only, which isn't in the snapshot
+    if update_fields is not None and not set(update_fields) & {*USER_FIELDS, 'password'}:
+        return
+    forget_user(instance.pk)
+
+
+@receiver(post_migrate)
+def reinstall_search_index(sender, using, **kwargs):
+    """
+    SQLite drops the FTS triggers when a migration remakes blog_blog, so put them back after every migrate
+    """
+    if sender.label != 'blog':
+        return
+    connection = connections[using]
+    if SEARCH_MIGRATION in MigrationRecorder(connection).applied_migrations():
+        get_search_backend(using).install(connection)
@@ -0,0 +1,24 @@
+from django import template
+
+from blog.images import srcset
+
+register = template.Library()
+
+# the blog image spans the content column, at most ~720px wide
+DEFAULT_SIZES = '(max-width: 768px) 100vw, 720px'
+
+
+@register.inclusion_tag('blog/picture.html')
+def blog_picture(blog, sizes=DEFAULT_SIZES):
+    """
+    the <picture> of a blog: its resized WebP/JPEG copies (blog.images) in srcset, the original until
+    they are generated, the shared placeholder image when the blog has none
+    """
+    has_image = bool(blog.image)
+    return {
+        'blog': blog,
+        'has_image': has_image,
+        'webp_srcset': srcset(blog, 'webp') if has_image else '',
+        'jpeg_srcset': srcset(blog, 'jpeg') if has_image else '',
+        'sizes': sizes,
+    }
@@ -0,0 +1,169 @@
+"""
+Test helpers to pin the number of queries a URL runs, to check their query plans and to stand up
+a read replica, see QueryBudgetTestCase, QueryPlanTestCase and ReplicaRoutingTestCase in blog/tests.py
+"""
+import re
+from contextlib import ContextDecorator
+
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class query_budget(ContextDecorator):
+    """
+    context manager / decorator that fails when the wrapped code runs more than `budget` queries
+
+        with query_budget(2):
+            client.get('/')
+    """
+    def __init__(self, budget, using=DEFAULT_DB_ALIAS, label='block'):
+        self.budget = budget
+        self.using = using
+        self.label = label
+
+    def __enter__(self):
+        self.context = CaptureQueriesContext(connections[self.using])
+        self.context.__enter__()
+        return self.context
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.context.__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return False
+        executed = len(self.context.captured_queries)
+        if executed > self.budget:
+            queries = '\n'.join(f"{i}. {query['sql']}" for i, query in enumerate(self.context.captured_queries, 1))
+            raise QueryBudgetExceeded(f"{self.label} ran {executed} queries, the budget is {self.budget}:\n{queries}")
+        return False
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin, assertQueryBudget(url, budget) requests `url` with the test client
+    and fails when the request runs more queries than `budget`
+    """
+    def assertQueryBudget(self, url, budget, method='get', data=None, using=DEFAULT_DB_ALIAS):
+        with query_budget(budget, using=using, label=f"{method.upper()} {url}"):
+            response = getattr(self.client, method)(url, data=data)
+        return response
+
+    def count_queries(self, url, method='get', data=None, using=DEFAULT_DB_ALIAS):
+        with CaptureQueriesContext(connections[using]) as context:
+            getattr(self.client, method)(url, data=data)
+        return len(context.captured_queries)
+
+
+# plan lines of a full table scan and of a sort the database has to do itself, per vendor
+PLAN_PROBLEMS = {
+    'sqlite': [
+        ('sequential scan', re.compile(r'^SCAN (?P<table>\w+)(?! USING| VIRTUAL TABLE)\s*$')),
+        ('temp sort', re.compile(r'USE TEMP B-TREE FOR (?:ORDER BY|RIGHT PART OF ORDER BY)')),
+    ],
+    'postgresql': [
+        ('sequential scan', re.compile(r'Seq Scan on (?P<table>\w+)')),
+        ('temp sort', re.compile(r'(?:^|->)\s*(?:Incremental )?Sort\b')),
+    ],
+}
+
+
+def explain(sql, params=None, using=DEFAULT_DB_ALIAS):
+    """
+    the query plan of one SQL statement as a list of lines
+    """
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+        rows = cursor.fetchall()
+    # SQLite's EXPLAIN QUERY PLAN rows are (id, parent, notused, detail)
+    return [str(row[-1]) for row in rows]
+
+
+def plan_problems(plan, vendor, tables=None):
+    """
+    the sequential scans and sorts in `plan` (lines), scans only count on `tables` when given
+    """
+    problems = []
+    for line in plan:
+        for problem, pattern in PLAN_PROBLEMS.get(vendor, []):
+            match = pattern.search(line.strip())
+            if match is None:
+                continue
+            table = match.groupdict().get('table')
+            if table is not None and tables is not None and table.lower() not in tables:
+                continue
+            problems.append(f'{problem}: {line.strip()}')
+    return problems
+
+
+class QueryPlanMixin:
+    """
+    TestCase mixin checking query plans against a seeded dataset: assertIndexedQueries(url) requests `url`
+    and fails when one of its statements on the blog tables does a sequential scan or a sort,
+    assertIndexedQuerySet(queryset) does the same with QuerySet.explain()
+    """
+    plan_tables = ('blog_blog', 'blog_comment', 'blog_reaction')
+
+    def _plan_tables(self, using):
+        # SQLite names a subquery's table by its alias (U0), the plan can't tell which table that is
+        tables = set(self.plan_tables)
+        if connections[using].vendor == 'sqlite':
+            tables |= {f'u{i}' for i in range(10)}
+        return tables
+
+    def assertIndexedQuerySet(self, queryset):
+        vendor = connections[queryset.db].vendor
+        plan = queryset.explain().splitlines()
+        problems = plan_problems(plan, vendor, self._plan_tables(queryset.db))
+        if problems:
+            self.fail(f"{queryset.query}\n" + '\n'.join(problems + ['plan:'] + plan))
+
+    def assertIndexedQueries(self, url, method='get', data=None, using=DEFAULT_DB_ALIAS):
+        with CaptureQueriesContext(connections[using]) as context:
+            response = getattr(self.client, method)(url, data=data)
+        vendor = connections[using].vendor
+        for query in context.captured_queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                continue
+            plan = explain(sql, using=using)
+            problems = plan_problems(plan, vendor, self._plan_tables(using))
+            if problems:
+                self.fail(f"{method.upper()} {url}: {sql}\n" + '\n'.join(problems + ['plan:'] + plan))
+        return response
+
+
+class ReplicaDatabaseMixin:
+    """
+    TransactionTestCase mixin adding an in-memory SQLite database `replica_alias` for the test class,
+    migrated and flushed like default. Nothing replicates to it: replicate(*models) copies the rows
+    of default over, what hasn't been copied yet is replication lag
+    """
+    replica_alias = 'replica'
+
+    @classmethod
+    def setUpClass(cls):
+        connections.settings[cls.replica_alias] = {
+            **connections.settings[DEFAULT_DB_ALIAS],
+            'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:', 'OPTIONS': {}, 'TEST': {'NAME': None, 'MIRROR': None},
+        }
+        cls.databases = {*cls.databases, cls.replica_alias}
+        call_command('migrate', database=cls.replica_alias, verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[cls.replica_alias].close()
+        del connections[cls.replica_alias]
+        del connections.settings[cls.replica_alias]
+
+    def replicate(self, *models):
+        for model in models:
+            rows = list(model._base_manager.using(DEFAULT_DB_ALIAS).order_by())
+            model._base_manager.using(self.replica_alias).all()._raw_delete(self.replica_alias)
+            model._base_manager.using(self.replica_alias).bulk_create(rows)
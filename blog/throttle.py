@@ -0,0 +1,151 @@
+"""
+Token-bucket rate limiting of the expensive POSTs (login's password hashing, comment and reaction writes)
+
+Each throttle of BLOG_THROTTLES has one bucket per client and scope: 'ip' (REMOTE_ADDR, or the
+BLOG_THROTTLE_IP_HEADER set by a trusted proxy), 'user' (the logged in user) and 'username' (the
+username posted to the login form). A bucket holds up to N tokens and refills at N per period ('5/m':
+5 tokens, 5 more per minute). A request takes one token from each of its buckets, and when one of them is
+empty it is answered 429 with a Retry-After before the view runs: no authenticate(), no ORM write.
+Rejected requests take no token.
+
+The buckets live in the BLOG_THROTTLE_CACHE cache, shared by the workers with memcached or redis (per
+process with local memory). A bucket is read and written without a lock, two racing requests can both
+take the last token: the limit is approximate by a request or two.
+"""
+import functools
+import hashlib
+import math
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+from .metrics import record_throttle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[getattr(settings, 'BLOG_THROTTLE_CACHE', 'default')]
+
+
+def parse_rate(rate):
+    """
+    '5/m' or '20/10m' as (capacity, period in seconds)
+    """
+    count, _, period = rate.partition('/')
+    multiplier = period[:-1] or '1'
+    try:
+        return int(count), int(multiplier) * PERIODS[period[-1]]
+    except (KeyError, ValueError, IndexError):
+        raise ValueError(f"invalid throttle rate {rate!r}, expected e.g. '5/m' or '20/10m'")
+
+
+def client_ip(request):
+    header = getattr(settings, 'BLOG_THROTTLE_IP_HEADER', None)
+    if header and request.META.get(header):
+        # the closest address the proxy saw, X-Forwarded-For style lists end with it
+        return request.META[header].split(',')[-1].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def scope_identity(request, scope):
+    """
+    who a bucket of `scope` belongs to, None when the request has no such identity (an anonymous user)
+    """
+    if scope == 'ip':
+        return client_ip(request)
+    if scope == 'user':
+        user = getattr(request, 'user', None)
+        return str(user.pk) if user is not None and user.is_authenticated else None
+    if scope == 'username':
+        username = request.POST.get('username', '').strip().lower()
+        return username or None
+    raise ValueError(f"unknown throttle scope {scope!r}")
+
+
+def bucket_key(name, scope, identity):
+    # hashed, usernames can hold characters cache keys can't
+    digest = hashlib.sha256(identity.encode()).hexdigest()[:32]
+    return f'blog:throttle:{name}:{scope}:{digest}'
+
+
+def take_tokens(buckets, now=None):
+    """
+    takes one token from each of `buckets` ({key: (capacity, period)}) when all of them have one,
+    returns 0, or else the seconds until they all do (and takes nothing)
+    """
+    cache = get_cache()
+    now = time.time() if now is None else now
+    stored = cache.get_many(list(buckets))
+    updated, wait = {}, 0.0
+    for key, (capacity, period) in buckets.items():
+        tokens, last = stored.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - last) * capacity / period)
+        if tokens < 1:
+            wait = max(wait, (1 - tokens) * period / capacity)
+        updated[key] = (tokens - 1, now)
+    if wait:
+        return wait
+    # a bucket left alone for its period is full again, no need to keep it
+    for key, value in updated.items():
+        cache.set(key, value, timeout=math.ceil(buckets[key][1]) + 1)
+    return 0
+
+
+def _record(name, outcome):
+    with _stats_lock:
+        _stats[name, outcome] += 1
+    record_throttle(name, outcome)
+
+
+def throttle_stats():
+    """
+    {throttle: {'allowed': n, 'rejected': n}} of this process since start (or the last reset),
+    the rejected requests are the work shed
+    """
+    with _stats_lock:
+        stats = {}
+        for (name, outcome), count in _stats.items():
+            stats.setdefault(name, {'allowed': 0, 'rejected': 0})[outcome] = count
+        return stats
+
+
+def reset_throttle_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def throttle(name, methods=('POST',)):
+    """
+    view decorator rate limiting the `methods` requests of a view with the buckets of
+    BLOG_THROTTLES[name] ({scope: rate}), a throttle missing from the setting doesn't limit anything
+    """
+    def decorator(view_func):
+        @functools.wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            rates = getattr(settings, 'BLOG_THROTTLES', {}).get(name)
+            if not rates or request.method not in methods:
+                return view_func(request, *args, **kwargs)
+            buckets = {}
+            for scope, rate in rates.items():
+                identity = scope_identity(request, scope)
+                if identity is not None:
+                    buckets[bucket_key(name, scope, identity)] = parse_rate(rate)
+            wait = take_tokens(buckets) if buckets else 0
+            if wait:
+                _record(name, 'rejected')
+                retry_after = math.ceil(wait)
+                response = HttpResponse(f"Too many requests, try again in {retry_after} seconds.", status=429, content_type='text/plain')
+                response['Retry-After'] = str(retry_after)
+                return response
+            _record(name, 'allowed')
+            return view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,9 +1,10 @@
 from django.urls import path
 
-from . import views
+from . import api, views
 
 urlpatterns = [
     path("", views.ListBlogView.as_view(), name="home"),
+    path("hot/", views.hot, name="hot"),
     path("login/", views.login, name="login"),
     path("logout/", views.logout, name="logout"),
     path("new_post/", views.CreateBlogView.as_view(), name="new_blog_post"),
@@ -13,4 +14,9 @@ urlpatterns = [
     path("forgot_password/", views.forgot_password, name="forgot_password"),
     path("edit_blog/<int:blog_id>/", views.edit_blog, name="edit_blog"),
     path("del_comment/<int:blog_id>/<int:comment_id>/", views.delete_comment, name="delete_comment"),
+    path("export/<str:model>/", views.export_content, name="export"),
+    path("metrics/", views.metrics, name="metrics"),
+    path("api/posts/", api.post_list, name="api_posts"),
+    path("api/posts/<int:blog_id>/", api.post_detail, name="api_post"),
+    path("api/posts/<int:blog_id>/comments/", api.post_comments, name="api_post_comments"),
 ]
\ No newline at end of file
@@ -1,17 +1,32 @@
+import functools
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
 from django.contrib.auth import authenticate, login as login_auth, logout as logout_Auth
 from django.contrib.auth.models import User
 from django.contrib import messages
 from django.urls import reverse
 from .forms import BlogForm, CommentForm, UserForm, UpdateUserForm
-from .models import Blog, Comment, Reaction
+from .models import Blog, Comment, COMMENT_PATH_SEGMENT, HotScore, Reaction, REACTION_CHOICES, RelatedPost, comment_path_end, viewer_reaction
 from django.views.generic import ListView, DetailView, UpdateView, CreateView, DeleteView
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db.models import Q
-from django.core.paginator import Paginator
+from .pagination import CursorPaginator, ThreadPaginator, estimated_count
+from .cache import BlogFragmentCache, FEED_VERSION_KEY, anonymous_page_cache, version_key
+from django.utils.decorators import method_decorator
+from .conditional import blog_detail_validators, conditional_page, feed_validators
+from .export import EXPORTS, FORMATS, aencode, aexport_batches, encode, export_rows
+from .metrics import registry
+from .throttle import throttle
+from .pageviews import count_views
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 
 # Create your views here.
+# set_password() hashes like authenticate()
+@method_decorator(throttle('signup'), name='dispatch')
 class CreateUserView(CreateView):
     model = User
     form_class = UserForm
@@ -50,19 +65,67 @@ class CreateBlogView(LoginRequiredMixin, CreateView):
         return super().dispatch(request, *args, **kwargs)
 
 class ListBlogView(ListView):
+    """
+    Queries: 1 for the ETag/Last-Modified validators, 1 for the page of blogs joined with their authors,
+    with their counts and the viewer's vote (Blog.objects.for_feed), +1 catalog lookup for the estimated
+    total on PostgreSQL, plus the session and user lookups for a logged in user, whatever the page size
+    """
     model = Blog
     template_name = 'blog/index.html'
     paginate_by = 10
     context_object_name = 'posts'
     paginate_by = 5
 
+    @method_decorator(anonymous_page_cache(lambda request: [FEED_VERSION_KEY]))
+    @method_decorator(conditional_page(feed_validators))
+    def dispatch(self, request, *args, **kwargs):
+        """
+        anonymous readers are served from the full-page cache, purged when any blog changes
+        GETs carry ETag/Last-Modified and are answered 304 when the feed didn't change
+        """
+        return super().dispatch(request, *args, **kwargs)
+
     def get_queryset(self):
         search_query = self.request.GET.get('search')
-        queryvalue = super().get_queryset()
+        # the feed shows the excerpt, the counters and the viewer's vote, not the full body
+        queryvalue = super().get_queryset().for_feed(getattr(self.request, 'user', None))
         if search_query:
-            queryvalue = Blog.objects.filter(Q(content__contains=search_query) | Q(title__contains=search_query))
+            queryvalue = queryvalue.search(search_query)
         return queryvalue
 
+    def paginate_queryset(self, queryset, page_size):
+        """
+        overridden to use keyset pagination (?after=/?before= cursors) instead of OFFSET and COUNT(*)
+        search results are paged in rank order, the feed newest first with an estimated total
+        """
+        if self.request.GET.get('search'):
+            paginator = CursorPaginator(queryset, page_size, ordering=('-search_rank', '-posted_at', '-id'))
+        else:
+            paginator = CursorPaginator(queryset, page_size, count=estimated_count(queryset), count_is_estimate=True)
+        page = paginator.get_page(self.request.GET)
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+def hot(request):
+    """
+    the blogs ranked by their precomputed hot score (blog.hot), keyset paginated
+    Queries: 1 for the page of scores joined with their blogs and authors (read in index order) and the viewer's votes,
+    plus the session and user lookups for a logged in user
+    """
+    scores = HotScore.objects.select_related('blog__posted_by').defer('blog__content', 'blog__content_html')
+    if request.user.is_authenticated:
+        scores = scores.annotate(viewer_reaction=viewer_reaction(request.user, 'blog_id'))
+    paginator = CursorPaginator(scores, ListBlogView.paginate_by, ordering=('-score', '-blog_id'))
+    page = paginator.get_page(request.GET)
+    for score in page.object_list:
+        score.blog.viewer_reaction = getattr(score, 'viewer_reaction', None)
+    return render(request, 'blog/index.html', {
+        'paginator': paginator,
+        'page_obj': page,
+        'is_paginated': page.has_other_pages(),
+        'posts': [score.blog for score in page.object_list],
+    })
+
+@throttle('login')
 def login(request):
     if request.user.is_authenticated:
         return redirect('home')
@@ -84,23 +147,51 @@ def logout(request):
     logout_Auth(request)
     return redirect("home")
 
-def blog_detail(request, blog_id):
-    blg = get_object_or_404(Blog, id=blog_id)
-    comments = Comment.objects.filter(for_blog=blog_id)
+def comment_threads(comments):
+    """
+    the paginator of the comment threads of a blog page, 3 top-level comments per page with all their replies
+    """
+    return ThreadPaginator(comments, 3, COMMENT_PATH_SEGMENT, comment_path_end)
 
-    comment_pagin = Paginator(comments, 3)
-    page_number = request.GET.get("page")
-    page_obj = comment_pagin.get_page(page_number)
+def related_posts(blog_id):
+    """
+    the related posts of a blog page (blog.related) in rank order, one query on the unique_related_post_rank index
+    joined with their blogs
+    """
+    return RelatedPost.objects.filter(blog=blog_id).order_by('rank').values('related_id', title=F('related__title'))
 
-    up_vote_reaction=Reaction.objects.all().filter(raection_type="upvote").filter(post=blog_id).count()
-    down_vote_reaction=Reaction.objects.all().filter(raection_type="downvote").filter(post=blog_id).count()
+@throttle('blog_detail')
+@count_views
+@anonymous_page_cache(lambda request, blog_id: [version_key(blog_id)])
+@conditional_page(blog_detail_validators)
+def blog_detail(request, blog_id):
+    """
+    Anonymous GETs are served from the full-page cache, purged when the blog, its comments or reactions change.
+    GETs carry ETag/Last-Modified (1 validator query) and are answered 304 without building the page.
+    GETs are built from the versioned fragment cache (blog.cache): the rendered post body, the vote
+    counts and each comment page are cached per blog version, so a fully cached page runs no blog query.
+    Queries on a miss: 1 for the validators, 1 for the blog with its author, 1 for the related posts,
+    1 for the page of comment threads (3 top-level comments with all their replies) with their authors,
+    plus the session and user lookups for a logged in user, whatever the number of comments
+    Views are counted in the cache (blog.pageviews), no write per view.
+    A reaction POST is the blog lookup, one upsert and the counter recount (Reaction.objects.set_reaction),
+    an unknown reaction_type is answered 400
+    """
+    # the blog is only fetched when a POST or a cache miss needs it
+    get_blog = functools.cache(lambda: get_object_or_404(Blog.objects.select_related('posted_by'), id=blog_id))
 
     if request.method == 'POST':
-        comment_val = request.POST.get('content')
         reaction_type_ = request.POST.get('reaction_type')
         if not request.user.is_authenticated:
             return redirect('login')
-        form = CommentForm(request.POST)
+        if reaction_type_ and reaction_type_ != 'none' and reaction_type_ not in {choice.value for choice in REACTION_CHOICES}:
+            return HttpResponseBadRequest("reaction_type must be upvote, downvote or none")
+        blg = get_blog()
+        if reaction_type_:
+            # 'none' withdraws the vote
+            Reaction.objects.set_reaction(blg, request.user, None if reaction_type_ == 'none' else reaction_type_)
+            return redirect('blog_detail', blog_id)
+        form = CommentForm(request.POST, blog_id=blog_id)
         if form.is_valid():
             # content = form.cleaned_data["content"]
             isinstance = form.save(commit=False)
@@ -108,51 +199,57 @@ def blog_detail(request, blog_id):
             isinstance.for_blog = blg
             # print("content created")
             form.save()
-            # return redirect('blog_detail', blog_id=blog_id)
-
-        # ---------------------------------------------------
-
-        existing_reaction = Reaction.objects.filter(post=blg, user=request.user).first()
-        if reaction_type_:
-            if existing_reaction:
-                existing_reaction.raection_type = reaction_type_
-                existing_reaction.save()
-            else:
-                reaction = Reaction.objects.create(
-                    post = blg,
-                    user = request.user,
-                    raection_type = reaction_type_
-                )
-            return redirect('blog_detail', blog_id)
+            return redirect('blog_detail', blog_id=blog_id)
     else:
         form = CommentForm()
 
-    return render(request, "blog/blog.html", {'blog': blg, 'form':form, 'page_obj': page_obj, 'up_vote_reaction':up_vote_reaction, 'down_vote_reaction':down_vote_reaction})
+    fragments = BlogFragmentCache(blog_id)
+    blog_body = fragments.get_or_set('body', lambda: render_to_string("blog/blog_body.html", {'blog': get_blog()}))
+    # all the counts come from the denormalized counters on the blog row, no COUNT(*) queries
+    votes = fragments.get_or_set('votes', lambda: {'up': get_blog().upvote_count, 'down': get_blog().downvote_count, 'views': get_blog().view_count, 'readers': get_blog().unique_readers})
+    related = fragments.get_or_set('related', lambda: list(related_posts(blog_id)))
+
+    comments = Comment.objects.filter(for_blog=blog_id).select_related('posted_by')
+    comment_pagin = comment_threads(comments)
+    page_obj = fragments.get_or_set_page('comments', comment_pagin, request.GET, count=lambda: get_blog().thread_count)
+
+    return render(request, "blog/blog.html", {'blog_id': blog_id, 'blog_body': blog_body, 'form':form, 'page_obj': page_obj, 'up_vote_reaction':votes['up'], 'down_vote_reaction':votes['down'], 'votes': votes, 'related': related})
 
 def edit_blog(request, blog_id):
+    """
+    Queries (GET): 1 for the blog, plus the session and user lookups
+    """
     if not request.user.is_authenticated:
         return redirect('login')
     blg = get_object_or_404(Blog, pk=blog_id)
-    form = BlogForm(request.POST or None, instance=blg)
-    if blg.posted_by != request.user:
+    form = BlogForm(request.POST or None, request.FILES or None, instance=blg)
+    # compare ids, blg.posted_by would fetch the author
+    if blg.posted_by_id != request.user.id:
         return redirect('blog_detail', blog_id)
     if form.is_valid():
         form.save()
     return render(request, "blog/edit_blog.html", {"form":form})
 
 def delete_comment(request, blog_id, comment_id):
+    """
+    Queries: 1 for the comment, then the delete and the comment_count update, plus the session and user lookups
+    """
     if not request.user.is_authenticated:
         return redirect('login')
     comment_ = get_object_or_404(Comment, pk=comment_id)
-    if comment_.posted_by.id == request.user.id:
-        comment_.delete()
+    if comment_.posted_by_id == request.user.id:
+        # with its replies, in one DELETE
+        Comment.objects.delete_thread(comment_)
     return redirect('blog_detail', blog_id)
 
 def my_account(request):
+    """
+    Queries (GET): the user being edited, request.user only holds the cached snapshot fields
+    (saving the form drops the snapshot, see blog.auth)
+    """
     if not request.user.is_authenticated:
         return redirect('login')
-    detail = get_object_or_404(User, pk=request.user.id)
-    # User.objects.get(pk=request.user.id)
+    detail = User.objects.get(pk=request.user.id)
     form = UpdateUserForm(request.POST or None, instance=detail)
     if form.is_valid():
         form.save()
@@ -160,4 +257,55 @@ def my_account(request):
 
 
 def forgot_password(request):
-    return render(request, "blog/forgot_password.html")
\ No newline at end of file
+    return render(request, "blog/forgot_password.html")
+
+def export_content(request, model):
+    """
+    staff only, streams every blog, comment or reaction (`model`) as NDJSON or CSV (?format=),
+    ordered by (updated_at, id). ?since=<ISO datetime> only exports the rows changed since,
+    with ?after_id= it continues after the row (since, after_id), i.e. the last row received.
+    Memory stays flat whatever the table size, under WSGI and ASGI (blog.export)
+    """
+    if not request.user.is_authenticated:
+        return redirect('login')
+    if not request.user.is_staff:
+        return redirect('home')
+    if model not in EXPORTS:
+        raise Http404("Unknown export")
+    export_format = request.GET.get('format', 'ndjson')
+    if export_format not in FORMATS:
+        return HttpResponseBadRequest("format must be ndjson or csv")
+    since = after_id = None
+    try:
+        if request.GET.get('since'):
+            since = parse_datetime(request.GET['since'])
+            if since is None:
+                raise ValueError(request.GET['since'])
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+        if request.GET.get('after_id'):
+            after_id = int(request.GET['after_id'])
+    except ValueError:
+        return HttpResponseBadRequest("since must be an ISO datetime and after_id an integer")
+
+    if isinstance(request, ASGIRequest):
+        # an ASGI response would read a sync iterator to the end before sending anything
+        content = aencode(model, aexport_batches(model, since=since, after_id=after_id), export_format)
+    else:
+        content = encode(model, export_rows(model, since=since, after_id=after_id), export_format)
+    response = StreamingHttpResponse(content, content_type=FORMATS[export_format])
+    response['Content-Disposition'] = f'attachment; filename="{model}-{timezone.now():%Y%m%d%H%M%S}.{export_format}"'
+    # let a proxy pass the rows through as they come
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def metrics(request):
+    """
+    staff only, the request histograms of this process (blog.metrics) in the Prometheus text format
+    """
+    if not request.user.is_authenticated:
+        return redirect('login')
+    if not request.user.is_staff:
+        return redirect('home')
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
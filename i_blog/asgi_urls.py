@@ -0,0 +1,14 @@
+"""
+URL configuration of ASGI requests: i_blog.urls with the async reader views of blog.async_views
+
+Selected per request by blog.middleware.AsyncViewsMiddleware, see BLOG_ASYNC_URLCONF in settings.
+"""
+from django.conf import settings
+from django.conf.urls.static import static
+from django.contrib import admin
+from django.urls import path, include
+
+urlpatterns = [
+    path("", include("blog.async_urls")),
+    path("admin/", admin.site.urls),
+] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
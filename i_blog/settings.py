@@ -42,11 +42,20 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Server-Timing header and the /metrics/ histograms (see BLOG_SERVER_TIMING below)
+    'blog.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # reads on the replicas, read-your-writes on the primary (see BLOG_DB_REPLICAS below)
+    'blog.middleware.PrimaryPinMiddleware',
+    # DEBUG only, warns about N+1 queries (see BLOG_REPEATED_QUERY_THRESHOLD below)
+    'blog.middleware.RepeatedQueryLogMiddleware',
+    # ASGI requests get the async feed and blog pages (see BLOG_ASYNC_URLCONF below)
+    'blog.middleware.AsyncViewsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # request.user from a cached user snapshot (see BLOG_USER_CACHE below)
+    'blog.middleware.CachedAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -55,7 +64,8 @@ ROOT_URLCONF = 'i_blog.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # the Django backend, timing renders for blog.metrics
+        'BACKEND': 'blog.metrics.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -90,9 +100,101 @@ DATABASES = {
         'PASSWORD':'0okmnhy6:)',
         'HOST':'localhost',
         'PORT':'5432',
+    },
+    # a read replica of default, listed in BLOG_DB_REPLICAS
+    # 'replica': {
+    #     'ENGINE': 'django.db.backends.postgresql_psycopg2',
+    #     'NAME': 'i_blog',
+    #     'USER': 'iyasu',
+    #     'PASSWORD':'0okmnhy6:)',
+    #     'HOST':'replica.localhost',
+    #     'PORT':'5432',
+    #     'TEST': {'MIRROR': 'default'},
+    # },
+}
+
+DATABASE_ROUTERS = ['blog.routers.PrimaryReplicaRouter']
+
+# aliases of the read replicas of default: the reads of GET requests go to one of them, writes and the reads
+# of a client for BLOG_DB_PRIMARY_PIN_SECONDS after it wrote stay on default (blog.routers), keep the
+# replication lag below that window. No replica: everything on default
+BLOG_DB_REPLICAS = []
+BLOG_DB_PRIMARY_PIN_SECONDS = 10
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# the blog fragment cache only needs get/set/add/incr, local-memory and file backends work
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
+# cache alias and timeout (seconds) of the versioned blog detail fragments (blog.cache)
+BLOG_FRAGMENT_CACHE = 'default'
+BLOG_FRAGMENT_CACHE_TIMEOUT = 3600
+
+# sessions are read from the cache, the database only on a cache miss, and written only when changed.
+# 'django.contrib.sessions.backends.signed_cookies' keeps them out of the database entirely, but then
+# logout only forgets the session in the browser that logged out
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'default'
+SESSION_SAVE_EVERY_REQUEST = False
+
+# cache alias holding the blog page views and reader sketches until `manage.py flush_blog_views` writes
+# them (blog.pageviews), run it more often than BLOG_VIEW_BUFFER_TIMEOUT (seconds) or views are lost
+BLOG_VIEW_CACHE = 'default'
+BLOG_VIEW_BUFFER_TIMEOUT = 86400
+
+# cache alias and timeout (seconds) of the user snapshots request.user is built from (blog.auth)
+BLOG_USER_CACHE = 'default'
+BLOG_USER_CACHE_TIMEOUT = 300
+
+# full-page cache of the feed and blog pages for anonymous readers (blog.cache.anonymous_page_cache)
+# pages are fresh for BLOG_PAGE_CACHE_TIMEOUT seconds, one request regenerates an expired page while
+# the others are served the stale copy or wait up to BLOG_PAGE_CACHE_LOCK_WAIT seconds
+BLOG_PAGE_CACHE_TIMEOUT = 300
+BLOG_PAGE_CACHE_LOCK_TIMEOUT = 10
+BLOG_PAGE_CACHE_LOCK_WAIT = 2
+
+# Cache-Control max-age (seconds) of anonymous feed and blog pages, they are always revalidated
+# with their ETag once it runs out (blog.conditional)
+BLOG_PUBLIC_MAX_AGE = 0
+
+# hot ranking of /hot/ (blog.hot): a blog needs 10x the points (upvotes - downvotes + comments x weight)
+# of one posted BLOG_HOT_DECAY_SECONDS later to rank level with it, rescore with
+# `manage.py refresh_hot_scores --full` after changing them
+BLOG_HOT_DECAY_SECONDS = 45000
+BLOG_HOT_COMMENT_WEIGHT = 0.5
+# the incremental hot score refreshes and related posts builds also take the rows touched this many seconds
+# before the previous one started, longer than the longest write transaction so the ones committed while it ran
+# aren't missed
+BLOG_REFRESH_OVERLAP = 300
+
+# related posts of the blog pages (blog.related): the BLOG_RELATED_COUNT blogs with the most similar text,
+# at least BLOG_RELATED_MIN_SCORE (cosine similarity of their TF-IDF vectors), rebuild them with
+# `manage.py build_related_posts --full` after changing them
+BLOG_RELATED_COUNT = 5
+BLOG_RELATED_MIN_SCORE = 0.05
+
+# token-bucket limits of the POSTs of the login, signup and blog (comments, reactions) views (blog.throttle),
+# {view: {scope: 'N/period'}} with scope 'ip', 'user' or 'username' (posted to the login form) and period
+# s, m, h, d, optionally with a count ('20/10m'); beyond them requests get a 429 before any hashing or write
+BLOG_THROTTLES = {
+    'login': {'ip': '20/10m', 'username': '5/5m'},
+    'signup': {'ip': '5/h'},
+    'blog_detail': {'ip': '60/m', 'user': '20/m'},
+}
+# cache alias of the buckets, use a shared one (memcached, redis) so the limits hold across workers
+BLOG_THROTTLE_CACHE = 'default'
+# META key of the client address set by a trusted reverse proxy (e.g. 'HTTP_X_REAL_IP'), None: REMOTE_ADDR
+BLOG_THROTTLE_IP_HEADER = None
+
+# URLconf of ASGI requests, with the async feed and blog pages of blog.async_views
+# (None serves ASGI requests with the sync views of ROOT_URLCONF)
+BLOG_ASYNC_URLCONF = 'i_blog.asgi_urls'
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -128,8 +230,37 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/4.2/howto/static-files/
 
 STATIC_URL = 'static/'
+# collectstatic writes the files here with a hash of their content in the name (staticfiles.json maps
+# them), serve STATIC_URL from it with `Cache-Control: public, max-age=31536000, immutable`
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# uploaded blog images and their resized copies (blog.images), served by runserver when DEBUG
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'blog.storage.HashedStaticFilesStorage',
+    },
+}
+
+# threads generating the resized copies of uploaded blog images after the request, 0 generates them
+# in the request once the blog is committed (`manage.py generate_blog_images` catches up on failures)
+BLOG_IMAGE_WORKERS = 2
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Number of times one SQL shape may run within a request before RepeatedQueryLogMiddleware
+# logs a warning (DEBUG only)
+
+BLOG_REPEATED_QUERY_THRESHOLD = 3
+
+# True: RequestMetricsMiddleware sends each request's SQL, template and cache timings in a Server-Timing
+# header to every client, False only with DEBUG (the /metrics/ histograms are collected either way)
+BLOG_SERVER_TIMING = False